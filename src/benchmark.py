@@ -0,0 +1,219 @@
+"""
+Benchmarks of ngram model building & scoring, corpus processing and conll evaluation on synthetic data.
+Results are printed (or written) as JSON, one record per benchmark & size, to compare across versions.
+
+    python benchmark.py --sizes 10000 100000 1000000 --output results.json
+"""
+
+
+def zipf_corpus(tokens, vocab=10000, exponent=1.0, length=(5, 20), seed=0):
+    """
+    generate corpus of Zipf-distributed words: p(word of rank r) ~ 1 / r^exponent
+    :param tokens: number of tokens to generate (approximately, last sentence is complete)
+    :param vocab: vocabulary size
+    :param exponent: Zipf exponent
+    :param length: min & max sentence length
+    :param seed: random seed
+    :return: list-of-lists
+    """
+    import random
+    from itertools import accumulate
+    rng = random.Random(seed)
+    words = ['w' + str(i) for i in range(vocab)]
+    weights = list(accumulate(1.0 / (r ** exponent) for r in range(1, vocab + 1)))
+
+    corpus = []
+    total = 0
+    while total < tokens:
+        sent = rng.choices(words, cum_weights=weights, k=rng.randint(*length))
+        corpus.append(sent)
+        total += len(sent)
+    return corpus
+
+
+def bio_corpus(tokens, vocab=10000, classes=10, chunk=0.3, noise=0.1, length=(5, 20), seed=0):
+    """
+    generate BIO-tagged corpus with a noisy hypothesis: sentences are lists of (word, reference, hypothesis)
+    :param tokens: number of tokens to generate (approximately, last sentence is complete)
+    :param vocab: vocabulary size
+    :param classes: number of chunk classes
+    :param chunk: probability of a chunk to start at a token
+    :param noise: probability of a hypothesis tag to differ from the reference one
+    :param length: min & max sentence length
+    :param seed: random seed
+    :return: list-of-lists of tuples
+    """
+    import random
+    rng = random.Random(seed)
+    labels = ['c' + str(i) for i in range(classes)]
+    tags = ['O'] + [prefix + label for label in labels for prefix in ['B-', 'I-']]
+
+    def tagging(size):
+        seq = []
+        while len(seq) < size:
+            if rng.random() < chunk:
+                label = rng.choice(labels)
+                span = min(rng.randint(1, 3), size - len(seq))
+                seq += ['B-' + label] + ['I-' + label] * (span - 1)
+            else:
+                seq.append('O')
+        return seq
+
+    corpus = []
+    for sent in zipf_corpus(tokens, vocab=vocab, length=length, seed=seed):
+        refs = tagging(len(sent))
+        hyps = [rng.choice(tags) if rng.random() < noise else tag for tag in refs]
+        corpus.append(list(zip(sent, refs, hyps)))
+    return corpus
+
+
+def measure(func, memory=False):
+    """
+    run function once, measuring wall time & (optionally) peak memory allocated by python
+    :param func: function without arguments
+    :param memory: trace peak memory with tracemalloc (slows execution down)
+    :return: tuple of function result & dict of measurements
+    """
+    import time
+    import tracemalloc
+
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    stats = {'time': time.perf_counter() - start}
+    if memory:
+        stats['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, stats
+
+
+def benchmark(tokens, n=3, vocab=10000, memory=False, seed=0, workers=2):
+    """
+    run benchmarks on synthetic data of a given size
+    :param tokens: corpus size in tokens
+    :param n: ngram size
+    :param vocab: vocabulary size
+    :param memory: measure peak memory
+    :param seed: random seed
+    :param workers: number of processes for parallel counting
+    :return: list of result records
+    """
+    from corpus import Corpus, Lexicon
+    from ngram import NgramModel, ArrayTrie
+    from conll import conlleval
+    from multiprocessing import cpu_count
+
+    results = []
+
+    def record(name, stats, items):
+        stats.update({'benchmark': name, 'tokens': tokens, 'n': n, 'vocab': vocab, 'items': items})
+        stats['throughput'] = items / stats['time'] if stats['time'] else float('inf')
+        results.append(stats)
+
+    # corpus: lexicon & oov replacement on held-out data (items are tokens actually generated)
+    train = zipf_corpus(tokens, vocab=vocab, seed=seed)
+    test = zipf_corpus(max(tokens // 10, 1), vocab=vocab * 2, seed=seed + 1)
+    size = sum(len(sent) for sent in train)
+    test_size = sum(len(sent) for sent in test)
+
+    corpus = Corpus()
+    corpus.corpus = train
+    corpus.lexicon, stats = measure(lambda: Lexicon(corpus=train), memory=memory)
+    record('corpus.lexicon', stats, size)
+
+    test, stats = measure(lambda: corpus.oov(data=test), memory=memory)
+    record('corpus.oov', stats, test_size)
+
+    # ngram: serial & parallel counting (parallel counts are compact; speedup requires as many cores as workers)
+    lm = NgramModel()
+    _, serial = measure(lambda: lm.count(train, n=n), memory=memory)
+    record('ngram.count', serial, size)
+
+    _, stats = measure(lambda: lm.count_parallel(train, n=n, workers=workers), memory=memory)
+    stats.update({'workers': workers, 'cpus': cpu_count(), 'speedup': serial['time'] / stats['time']})
+    record('ngram.count_parallel', stats, size)
+
+    # ngram: model building & compaction, scoring of the compact model (score_batch scores it in bulk)
+    lm, stats = measure(lambda: NgramModel(train, n=n, smoothing=True, backoff=True), memory=memory)
+    record('ngram.make', stats, size)
+
+    lm.model, stats = measure(lambda: ArrayTrie(lm.model), memory=memory)
+    record('ngram.compact', stats, size)
+
+    _, stats = measure(lambda: [lm.score(sent) for sent in test], memory=memory)
+    record('ngram.score', stats, test_size)
+
+    _, stats = measure(lambda: lm.score_batch(test), memory=memory)
+    record('ngram.score_batch', stats, test_size)
+
+    # conll: evaluation of noisy hypotheses
+    data = bio_corpus(tokens, vocab=vocab, seed=seed)
+    _, stats = measure(lambda: conlleval(data), memory=memory)
+    record('conll.conlleval', stats, sum(len(sent) for sent in data))
+
+    return results
+
+
+def main(argv=None):
+    import sys
+    import json
+    import argparse
+    import platform
+
+    parser = argparse.ArgumentParser(description="benchmark ngram, corpus & conll on synthetic data")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help="corpus sizes in tokens")
+    parser.add_argument('-n', type=int, default=3, help="ngram size")
+    parser.add_argument('--vocab', type=int, default=10000, help="vocabulary size")
+    parser.add_argument('--memory', action='store_true', help="measure peak memory (slower)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+    parser.add_argument('--workers', type=int, default=2, help="number of processes for parallel counting")
+    parser.add_argument('--output', help="output JSON file (default stdout)")
+    args = parser.parse_args(argv)
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': [record for tokens in args.sizes
+                    for record in benchmark(tokens, n=args.n, vocab=args.vocab, memory=args.memory, seed=args.seed,
+                                            workers=args.workers)]
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+def test_synthetic():
+    corpus = zipf_corpus(1000, vocab=50)
+    assert sum(len(sent) for sent in corpus) >= 1000
+    assert corpus == zipf_corpus(1000, vocab=50)
+    assert all(5 <= len(sent) <= 20 for sent in corpus)
+
+    from collections import Counter
+    freq = Counter(token for sent in corpus for token in sent)
+    assert freq['w0'] > freq['w9'] > freq['w49']
+
+    data = bio_corpus(1000, vocab=50, noise=0.0)
+    assert all(ref == hyp for sent in data for _, ref, hyp in sent)
+    for sent in data:
+        tags = [ref for _, ref, _ in sent]
+        assert all(not tag.startswith('I-') or prev[2:] == tag[2:] for prev, tag in zip(['O'] + tags, tags))
+
+
+def test_benchmark():
+    results = benchmark(2000, n=2, vocab=100, memory=True)
+    assert [r['benchmark'] for r in results] == ['corpus.lexicon', 'corpus.oov', 'ngram.count',
+                                                 'ngram.count_parallel', 'ngram.make', 'ngram.compact',
+                                                 'ngram.score', 'ngram.score_batch', 'conll.conlleval']
+    assert results[3]['speedup'] > 0
+    assert results[0]['tokens'] == 2000 and results[0]['items'] == sum(map(len, zipf_corpus(2000, vocab=100)))
+    assert results[-1]['items'] == sum(map(len, bio_corpus(2000, vocab=100)))
+    assert all(r['time'] >= 0 and r['peak_memory'] > 0 for r in results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""
+Columnar binary cache of parsed corpus files: token ids per column, vocabulary per column & sentence offsets.
+Cache is stored next to the source file & is valid while source path, size & modification time are unchanged.
+"""
+
+MAGIC = b'COLUMNS\x02'  # cache format identifier & version
+
+
+def cache_file(source):
+    return source + '.cache'
+
+
+def signature(source, **key):
+    """
+    cache key of a source file
+    :param source: source file
+    :param key: parsing parameters (e.g. field separator)
+    :return: dict
+    """
+    import os
+    stat = os.stat(source)
+    return dict(key, path=os.path.abspath(source), size=stat.st_size, mtime=stat.st_mtime_ns)
+
+
+def intern(column):
+    """
+    encode a column of tokens as ids (assigned in first occurrence order)
+    :param column: list of tokens
+    :return: tuple of vocabulary (id -> token) & id array
+    """
+    from array import array
+    vocab = list(dict.fromkeys(column))
+    ids = {token: i for i, token in enumerate(vocab)}
+    return vocab, array('i', map(ids.__getitem__, column))
+
+
+class Sentences(object):
+    """
+    read-only sequence of sentences over (memory-mapped) cache arrays: sentences are decoded only when accessed
+    """
+
+    def __init__(self, vocabs, views, offsets, meta=None, flat=False, buffer=None):
+        self.vocabs = vocabs    # vocabulary (id -> token) of every selected column
+        self.views = views      # id array of every selected column
+        self.offsets = offsets  # sentence i is [offsets[i], offsets[i+1]) of every column
+        self.meta = meta        # additional information stored with the cache
+        self.flat = flat        # sentences as lists of tokens (of a single column) instead of lists of tuples
+        self.buffer = buffer    # cache file contents (memory-mapped)
+
+    def __set__(self, instance, value):
+        self.instance = value
+
+    def __get__(self, instance, owner):
+        return self.instance
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+
+        i = i + len(self) if i < 0 else i
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        columns = [list(map(vocab.__getitem__, view[lo:hi])) for vocab, view in zip(self.vocabs, self.views)]
+        if self.flat:
+            return columns[0] if columns else []
+        return list(zip(*columns)) if columns else [()] * (hi - lo)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+
+def dump(source, columns, offsets, meta=None, **key):
+    """
+    write cache of a parsed source file (failures to write are ignored)
+    :param source: source file
+    :param columns: list of columns (flat lists of tokens of all sentences)
+    :param offsets: sentence offsets: sentence i is [offsets[i], offsets[i+1]) of every column
+    :param meta: additional json-serializable information to store (e.g. token frequencies)
+    :param key: parsing parameters (e.g. field separator)
+    """
+    import os
+    import sys
+    import json
+    import struct
+    import tempfile
+    from array import array
+
+    vocabs = []
+    arrays = []
+    for column in columns:
+        vocab, ids = intern(column)
+        vocabs.append(vocab)
+        arrays.append(ids)
+    arrays.append(array('q', offsets))
+
+    header = json.dumps({
+        'key': signature(source, **key),
+        'byteorder': sys.byteorder,
+        'vocabs': vocabs,
+        'tokens': len(columns[0]) if columns else 0,
+        'sents': len(offsets) - 1,
+        'meta': meta
+    }).encode('utf-8')
+
+    target = cache_file(source)
+    try:
+        # unique temporary file: concurrent writers of the same cache do not share it
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target)),
+                                   prefix=os.path.basename(target) + '.', suffix='.tmp')
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            for data in arrays:
+                f.write(b'\0' * (-f.tell() % 8))
+                f.write(data.tobytes())
+        os.replace(tmp, target)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def load(source, columns=None, mmap=True, flat=False, **key):
+    """
+    read cache of a source file; id arrays are memory-mapped & sentences are decoded on access
+    :param source: source file
+    :param columns: indices of columns to decode (default all)
+    :param mmap: memory-map cache file instead of reading it
+    :param flat: sentences as lists of tokens of the (single) selected column
+    :param key: parsing parameters (e.g. field separator)
+    :return: Sentences; None if there is no valid cache
+    """
+    import os
+    import sys
+    import json
+    import struct
+    from array import array
+
+    path = cache_file(source)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None
+        length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length).decode('utf-8'))
+        start = f.tell()
+
+        if header['key'] != signature(source, **key) or header['byteorder'] != sys.byteorder:
+            return None
+
+        if mmap:
+            import mmap as mm
+            buffer = memoryview(mm.mmap(f.fileno(), 0, access=mm.ACCESS_READ))
+        else:
+            f.seek(0)
+            buffer = memoryview(f.read())
+
+    vocabs = header['vocabs']
+    tokens = header['tokens']
+
+    # column id arrays followed by offsets array (8-byte aligned)
+    views = []
+    pos = start
+    for typecode, length in [('i', tokens)] * len(vocabs) + [('q', header['sents'] + 1)]:
+        pos += -pos % 8
+        views.append(buffer[pos:pos + length * array(typecode).itemsize].cast(typecode))
+        pos += length * array(typecode).itemsize
+
+    # files without columns (empty) have nothing to select; negative indices count from the last column
+    if columns is None or not vocabs:
+        columns = range(len(vocabs))
+    else:
+        for c in columns:
+            if not -len(vocabs) <= c < len(vocabs):
+                raise IndexError("Column index out of range: {} ({} columns)".format(c, len(vocabs)))
+        columns = [c % len(vocabs) for c in columns]
+    return Sentences([vocabs[c] for c in columns], [views[c] for c in columns], views[-1],
+                     meta=header.get('meta'), flat=flat, buffer=buffer)
+
+
+def test_cache():
+    import os
+    import time
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'corpus.txt')
+        with open(source, 'w') as f:
+            f.write("the cat\n")
+
+        columns = [['the', 'cat', 'a', 'cat'], ['O', 'B-animal', 'O', 'B-animal']]
+        offsets = [0, 2, 2, 4]
+        sents = [[('the', 'O'), ('cat', 'B-animal')], [], [('a', 'O'), ('cat', 'B-animal')]]
+
+        assert load(source) is None
+        dump(source, columns, offsets, meta={'n': 1}, fs="\t")
+        for mmap in [True, False]:
+            cached = load(source, fs="\t", mmap=mmap)
+            assert isinstance(cached, Sentences) and len(cached) == 3 and cached.meta == {'n': 1}
+            assert cached == sents and cached[-1] == sents[-1] and cached[1:] == sents[1:]
+        assert load(source, columns=[1], fs="\t") == [[(tag,) for word, tag in sent] for sent in sents]
+        assert load(source, columns=[-1, 0], fs="\t") == [[(tag, word) for word, tag in sent] for sent in sents]
+        assert load(source, columns=[0], flat=True, fs="\t") == [['the', 'cat'], [], ['a', 'cat']]
+        for columns in [[2], [-3]]:
+            try:
+                load(source, columns=columns, fs="\t")
+                assert False
+            except IndexError:
+                pass
+
+        # different parameters or modified source invalidate cache
+        assert load(source, fs=" ") is None
+        time.sleep(0.01)
+        with open(source, 'a') as f:
+            f.write("a cat\n")
+        assert load(source, fs="\t") is None
+
+        # source without columns
+        dump(source, [], [0], fs="\t")
+        assert load(source, columns=[-1], fs="\t") == []
+
+
+if __name__ == '__main__':
+    print("Testing Only...")
+    test_cache()
+    print("Done!")
@@ -1,4 +1,5 @@
 import re
+from operator import itemgetter
 
 """
 Modified version of https://pypi.org/project/conlleval/
@@ -9,12 +10,48 @@ def stats():
     return {'cor': 0, 'hyp': 0, 'ref': 0}
 
 
-def evaluate(ref, hyp, otag='O'):
+def evaluate(ref, hyp, otag='O', workers=1):
     # evaluation for NLTK
+    if workers > 1:
+        return evaluate_parallel(ref, hyp, otag=otag, workers=workers)
     aligned = align_hyp(ref, hyp)
     return conlleval(aligned, otag=otag)
 
 
+def evaluate_parallel(ref, hyp, otag='O', workers=2):
+    """
+    evaluate contiguous shards of sentences in worker processes & merge their counts
+    :param ref: reference sentences (lists of token tuples)
+    :param hyp: hypothesis sentences (lists of token tuples)
+    :param otag: out-of-chunk label
+    :param workers: number of processes
+    :return: scores
+    """
+    from multiprocessing import Pool
+
+    if len(ref) != len(hyp):
+        raise ValueError("Size Mismatch: ref: {} & hyp: {}".format(len(ref), len(hyp)))
+
+    step = max(-(-len(ref) // workers), 1)
+    shards = [(ref[i:i + step], hyp[i:i + step], otag, i) for i in range(0, len(ref), step)]
+
+    counts = EvalCounts(otag=otag)
+    with Pool(workers) as pool:
+        for shard in pool.map(count_shard, shards):
+            counts.merge(shard)
+    return counts.summarize()
+
+
+def count_shard(shard):
+    """
+    count a shard of sentences (worker function for parallel evaluation)
+    :param shard: tuple of reference sentences, hypothesis sentences, otag & index of the first sentence
+    :return: EvalCounts
+    """
+    ref, hyp, otag, offset = shard
+    return count_sentences(ref, hyp, otag=otag, offset=offset)
+
+
 def align_hyp(ref, hyp):
     # align references and hypothese for evaluation
     # add last element of token tuple in hyp to ref
@@ -29,13 +66,42 @@ def align_hyp(ref, hyp):
     return out
 
 
-def conlleval(data, otag='O'):
-    # token, segment & class level counts for TP, TP+FP, TP+FN
-    tok = stats()
-    seg = stats()
-    cls = {}
+class EvalCounts(object):
+    """
+    token, segment & class level counts for TP, TP+FP, TP+FN accumulated sentence by sentence
+    """
 
-    for sent in data:
+    def __init__(self, otag='O'):
+        self.otag = otag
+        self.tok = stats()
+        self.seg = stats()
+        self.cls = {}
+
+    def __set__(self, instance, value):
+        self.instance = value
+
+    def __get__(self, instance, owner):
+        return self.instance
+
+    def add(self, sent):
+        """
+        count a sentence
+        :param sent: list of token tuples with reference & hypothesis labels as the last two elements
+        """
+        self.add_labels(map(itemgetter(-2), sent), map(itemgetter(-1), sent))
+
+    def add_labels(self, refs, hyps):
+        """
+        count a sentence given as label sequences
+        :param refs: reference labels (iterable)
+        :param hyps: hypothesis labels (iterable)
+        """
+        otag = self.otag
+        tok = self.tok
+        seg = self.seg
+        cls = self.cls
+
+        table = chunk_table(otag)
 
         prev_ref = otag      # previous reference label
         prev_hyp = otag      # previous hypothesis label
@@ -44,16 +110,16 @@ def conlleval(data, otag='O'):
 
         in_correct = False  # currently processed chunks is correct until now
 
-        for token in sent:
-
-            hyp_iob, hyp = parse_iob(token[-1])
-            ref_iob, ref = parse_iob(token[-2])
+        for ref_lbl, hyp_lbl in zip(refs, hyps):
 
-            ref_e = is_eoc(ref, ref_iob, prev_ref, prev_ref_iob, otag)
-            hyp_e = is_eoc(hyp, hyp_iob, prev_hyp, prev_hyp_iob, otag)
+            hyp_iob, hyp = parse_iob(hyp_lbl)
+            ref_iob, ref = parse_iob(ref_lbl)
 
-            ref_b = is_boc(ref, ref_iob, prev_ref, prev_ref_iob, otag)
-            hyp_b = is_boc(hyp, hyp_iob, prev_hyp, prev_hyp_iob, otag)
+            # (begin, end) of chunk flags looked up by (previous iob, iob, label changed)
+            ref_b, ref_e = (table.get((prev_ref_iob, ref_iob, ref != prev_ref)) or
+                            boundaries(ref_iob, prev_ref_iob, ref != prev_ref, otag))
+            hyp_b, hyp_e = (table.get((prev_hyp_iob, hyp_iob, hyp != prev_hyp)) or
+                            boundaries(hyp_iob, prev_hyp_iob, hyp != prev_hyp, otag))
 
             if not cls.get(ref) and ref:
                 cls[ref] = stats()
@@ -97,12 +163,242 @@ def conlleval(data, otag='O'):
             seg['cor'] += 1
             cls[prev_ref]['cor'] += 1
 
-    return summarize(seg, cls)
+    def merge(self, other):
+        """
+        add counts of another accumulator (e.g. of another shard of sentences)
+        :param other: EvalCounts
+        :return: self
+        """
+        if other.otag != self.otag:
+            raise ValueError("Out-of-chunk label mismatch: {} & {}".format(self.otag, other.otag))
+
+        for key in ['cor', 'hyp', 'ref']:
+            self.tok[key] += other.tok[key]
+            self.seg[key] += other.seg[key]
+
+        for lbl, counts in other.cls.items():
+            cls = self.cls.setdefault(lbl, stats())
+            for key in ['cor', 'hyp', 'ref']:
+                cls[key] += counts[key]
+        return self
+
+    def summarize(self):
+        return summarize(self.seg, self.cls)
+
+
+def conlleval(data, otag='O'):
+    # token, segment & class level counts for TP, TP+FP, TP+FN
+    counts = EvalCounts(otag=otag)
+    for sent in data:
+        counts.add(sent)
+    return counts.summarize()
+
+
+def evaluate_stream(ref, hyp, otag='O', fs="\t"):
+    """
+    evaluate references & hypotheses read in lockstep sentence by sentence (in constant memory)
+    :param ref: reference corpus file in conll format or iterable of sentences (lists of token tuples)
+    :param hyp: hypothesis corpus file in conll format or iterable of sentences (e.g. tagger output generator)
+    :param otag: out-of-chunk label
+    :param fs: field separator (for files)
+    :return: scores
+    """
+    ref = iter_corpus_conll(ref, fs=fs) if isinstance(ref, str) else ref
+    hyp = iter_corpus_conll(hyp, fs=fs) if isinstance(hyp, str) else hyp
+    return count_sentences(ref, hyp, otag=otag).summarize()
+
+
+def count_sentences(ref, hyp, otag='O', offset=0):
+    """
+    count references & hypotheses read in lockstep, checking alignment sentence by sentence
+    :param ref: iterable of reference sentences (lists of token tuples)
+    :param hyp: iterable of hypothesis sentences (lists of token tuples)
+    :param otag: out-of-chunk label
+    :param offset: index of the first sentence (for error messages)
+    :return: EvalCounts
+    """
+    from itertools import zip_longest
+
+    counts = EvalCounts(otag=otag)
+    for i, (ref_sent, hyp_sent) in enumerate(zip_longest(ref, hyp), offset):
+        if ref_sent is None or hyp_sent is None:
+            raise ValueError("Size Mismatch: ref & hyp differ in number of sentences ({})".format(i))
+        if len(ref_sent) != len(hyp_sent):
+            raise ValueError("Size Mismatch: sentence {}: ref: {} & hyp: {}".format(i, len(ref_sent), len(hyp_sent)))
+        counts.add_labels(map(itemgetter(-1), ref_sent), map(itemgetter(-1), hyp_sent))
+    return counts
+
+
+def sentence_counts(ref, hyp, otag='O'):
+    """
+    segment counts of every sentence, per class & total (for resampling)
+    :param ref: reference sentences (lists of token tuples)
+    :param hyp: hypothesis sentences (lists of token tuples)
+    :param otag: out-of-chunk label
+    :return: dict label -> tuple of cor, hyp, ref count arrays indexed by sentence ('total' for all classes)
+    """
+    from array import array
+
+    if len(ref) != len(hyp):
+        raise ValueError("Size Mismatch: ref: {} & hyp: {}".format(len(ref), len(hyp)))
+
+    sents = [count_sentences([ref[i]], [hyp[i]], otag=otag, offset=i) for i in range(len(ref))]
+    labels = set(lbl for counts in sents for lbl in counts.cls)
+
+    vectors = {lbl: tuple(array('l', (counts.cls[lbl][key] if lbl in counts.cls else 0 for counts in sents))
+                          for key in ['cor', 'hyp', 'ref']) for lbl in labels}
+    vectors['total'] = tuple(array('l', (counts.seg[key] for counts in sents)) for key in ['cor', 'hyp', 'ref'])
+    return vectors
+
+
+def draw(size, n, seed=None):
+    """
+    draw bootstrap samples of sentence indices; with numpy samples are drawn as 2-D index arrays
+    (blocks of samples of bounded size), otherwise as lists of indices
+    :param size: number of sentences (sample size)
+    :param n: number of samples
+    :param seed: random seed
+    :return: generator of samples (lists of indices) or of blocks of samples (2-D numpy arrays)
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+
+    if np is None or not size:
+        import random
+        rng = random.Random(seed)
+        return (rng.choices(range(size), k=size) for _ in range(n))
+
+    rng = np.random.default_rng(seed)
+    rows = max(1, (1 << 22) // size)  # samples per block
+    return (rng.integers(0, size, size=(min(rows, n - i), size)) for i in range(0, n, rows))
+
+
+def resample(vectors, samples, labels=None):
+    """
+    scores of bootstrap samples: counts of sampled sentences are gathered from count arrays;
+    blocks of samples (2-D numpy arrays) are summed at once as sentence occurrence matrix x count matrix
+    :param vectors: sentence count arrays as returned by sentence_counts
+    :param samples: iterable of bootstrap samples (lists of sentence indices) or blocks of samples (see draw)
+    :param labels: labels to score (default all)
+    :return: dict label -> list of scores (one per sample)
+    """
+    labels = labels if labels else list(vectors.keys())
+    res = {lbl: [] for lbl in labels}
+    matrix = None
+    for idx in samples:
+        if getattr(idx, 'ndim', 1) == 2:
+            import numpy as np
+            if matrix is None:
+                # sentences x (cor, hyp, ref) counts of every label
+                # (float matrices use BLAS products; sums are exact integers below 2^53)
+                matrix = np.array([counts for lbl in labels for counts in vectors[lbl]], dtype=np.float64).T
+            rows, size = idx.shape
+            occurrences = np.bincount((idx + np.arange(rows)[:, None] * size).ravel(), minlength=rows * size)
+            sums = occurrences.reshape(rows, size).astype(np.float64) @ matrix
+            for sums in np.rint(sums).astype(np.int64).tolist():
+                for i, lbl in enumerate(labels):
+                    res[lbl].append(score(*sums[3 * i:3 * i + 3]))
+        else:
+            for lbl in labels:
+                res[lbl].append(score(*[sum(map(counts.__getitem__, idx)) for counts in vectors[lbl]]))
+    return res
+
+
+def bootstrap(ref, hyp, n=1000, alpha=0.05, otag='O', seed=None):
+    """
+    bootstrap confidence intervals of precision, recall & f-measure (percentile method);
+    sentence counts are computed once & every resample only sums them
+    :param ref: reference sentences (lists of token tuples)
+    :param hyp: hypothesis sentences (lists of token tuples)
+    :param n: number of resamples
+    :param alpha: significance level (0.05 -> 95% intervals)
+    :param otag: out-of-chunk label
+    :param seed: random seed
+    :return: dict label -> {'p': (low, high), 'r': (low, high), 'f': (low, high)}
+    """
+    vectors = sentence_counts(ref, hyp, otag=otag)
+    samples = draw(len(ref), n, seed=seed)
+
+    lo, hi = int(alpha / 2 * n), max(int((1 - alpha / 2) * n) - 1, 0)
+    res = {}
+    for lbl, scores in resample(vectors, samples).items():
+        res[lbl] = {}
+        for key in ['p', 'r', 'f']:
+            values = sorted(s[key] for s in scores)
+            res[lbl][key] = (values[lo], values[hi])
+    return res
+
+
+def bootstrap_compare(ref, hyp_a, hyp_b, n=1000, label='total', otag='O', seed=None):
+    """
+    paired bootstrap test of f-measure difference between two systems (on the same resamples)
+    :param ref: reference sentences (lists of token tuples)
+    :param hyp_a: hypothesis sentences of system a
+    :param hyp_b: hypothesis sentences of system b
+    :param n: number of resamples
+    :param label: label to compare ('total' for micro scores)
+    :param otag: out-of-chunk label
+    :param seed: random seed
+    :return: dict of observed f-measure difference (a - b) & p-value (share of resamples where a is not better)
+    """
+    vectors_a = sentence_counts(ref, hyp_a, otag=otag)
+    vectors_b = sentence_counts(ref, hyp_b, otag=otag)
+    empty = tuple([0] * len(ref) for _ in range(3))
+    vectors = {'a': vectors_a.get(label, empty), 'b': vectors_b.get(label, empty)}
+
+    size = len(ref)
+    scores = resample(vectors, draw(size, n, seed=seed))
+
+    delta = resample(vectors, [range(size)])
+    delta = delta['a'][0]['f'] - delta['b'][0]['f']
+    worse = sum(1 for a, b in zip(scores['a'], scores['b']) if a['f'] <= b['f'])
+    return {'delta': delta, 'p': worse / n}
+
+
+IOB_RE = re.compile(r'^([^-]*)-(.*)$')
+IOB_TAGS = ['B', 'I', 'E', 'L', 'S', 'U', '[', ']', '.']  # chunk prefixes of supported schemes
+
+_iob_cache = {}    # label -> (iob, label)
+_chunk_cache = {}  # otag -> boundaries table
 
 
 def parse_iob(t):
-    m = re.match(r'^([^-]*)-(.*)$', t)
-    return m.groups() if m else (t, None)
+    iob = _iob_cache.get(t)
+    if iob is None:
+        m = IOB_RE.match(t)
+        iob = _iob_cache[t] = m.groups() if m else (t, None)
+    return iob
+
+
+def boundaries(iob, prev_iob, changed, otag='O'):
+    """
+    is beginning & is end of a chunk (labels matter only for being different)
+
+    :param iob: current iob
+    :param prev_iob: previous iob
+    :param changed: if current label is different from previous label
+    :param otag: out-of-chunk label
+    :return: tuple of booleans (boc, eoc)
+    """
+    return (is_boc(changed, iob, False, prev_iob, otag),
+            is_eoc(changed, iob, False, prev_iob, otag))
+
+
+def chunk_table(otag='O'):
+    """
+    lookup table of chunk boundaries for the prefixes of IOB, IOBE & BILOU schemes (computed once per otag)
+
+    :param otag: out-of-chunk label
+    :return: dict (prev_iob, iob, changed) -> (boc, eoc)
+    """
+    table = _chunk_cache.get(otag)
+    if table is None:
+        tags = IOB_TAGS + [otag, None]
+        table = _chunk_cache[otag] = {(prev_iob, iob, changed): boundaries(iob, prev_iob, changed, otag)
+                                      for prev_iob in tags for iob in tags for changed in [False, True]}
+    return table
 
 
 def is_boc(lbl, iob, prev_lbl, prev_iob, otag='O'):
@@ -183,34 +479,206 @@ def summarize(seg, cls):
     return res
 
 
-def read_corpus_conll(corpus_file, fs="\t"):
+def read_corpus_conll(corpus_file, fs="\t", columns=None, cache=False):
     """
     read corpus in CoNLL format
     :param corpus_file: corpus in conll format
     :param fs: field separator
+    :param columns: indices of columns to keep (default all)
+    :param cache: read parsed corpus from (or write it to) columnar cache next to corpus file;
+        a cached corpus is a sequence of sentences decoded on access (cache.Sentences)
     :return: corpus
     """
+    if not cache:
+        return list(iter_corpus_conll(corpus_file, fs=fs, columns=columns))
+
+    from itertools import chain
+    from cache import dump, load
+
+    cached = load(corpus_file, columns=columns, fs=fs)
+    if cached is not None:
+        return cached
+
+    sents = list(iter_corpus_conll(corpus_file, fs=fs))
+    offsets = [0]
+    for sent in sents:
+        offsets.append(offsets[-1] + len(sent))
+    words = list(chain.from_iterable(sents))
+    dump(corpus_file, [list(map(itemgetter(c), words)) for c in range(len(words[0]) if words else 0)], offsets, fs=fs)
+
+    if columns:
+        select = itemgetter(*columns) if len(columns) > 1 else lambda feats: (feats[columns[0]],)
+        sents = [[select(word) for word in sent] for sent in sents]
+    return sents
+
+
+def iter_corpus_conll(corpus_file, fs="\t", columns=None):
+    """
+    read corpus in CoNLL format sentence by sentence
+    :param corpus_file: corpus in conll format
+    :param fs: field separator
+    :param columns: indices of columns to keep (default all)
+    :return: generator of sentences (lists of feature tuples)
+    """
+    select = None
+    if columns:
+        select = itemgetter(*columns) if len(columns) > 1 else lambda feats: (feats[columns[0]],)
+
     featn = None  # number of features for consistency check
-    sents = []  # list to hold words list sequences
     words = []  # list to hold feature tuples
 
-    for line in open(corpus_file):
-        line = line.strip()
-        if len(line.strip()) > 0:
-            feats = tuple(line.strip().split(fs))
-            if not featn:
-                featn = len(feats)
-            elif featn != len(feats) and len(feats) != 0:
-                raise ValueError("Unexpected number of columns {} ({})".format(len(feats), featn))
-
-            words.append(feats)
-        else:
-            if len(words) > 0:
-                sents.append(words)
+    with open(corpus_file) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                feats = line.split(fs)
+                if not featn:
+                    featn = len(feats)
+                elif featn != len(feats):
+                    raise ValueError("Unexpected number of columns {} ({})".format(len(feats), featn))
+
+                words.append(select(feats) if select else tuple(feats))
+            elif words:
+                yield words
                 words = []
-    return sents
+
+    if words:
+        yield words
 
 
 def get_chunks(corpus_file, fs="\t", otag="O"):
-    sents = read_corpus_conll(corpus_file, fs=fs)
-    return set([parse_iob(token[-1])[1] for sent in sents for token in sent if token[-1] != otag])
+    # scan labels (last column) without building sentences
+    labels = set()
+    with open(corpus_file) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                labels.add(line.rsplit(fs, 1)[-1])
+    return set([parse_iob(label)[1] for label in labels if label != otag])
+
+
+_ref = [
+    [('the', 'O'), ('cat', 'B-animal'), ('is', 'O'), ('in', 'O'), ('new', 'B-city'), ('york', 'I-city')],
+    [('a', 'O'), ('big', 'B-animal'), ('dog', 'I-animal')]
+]
+_hyp = [
+    [('the', 'O'), ('cat', 'B-animal'), ('is', 'O'), ('in', 'O'), ('new', 'B-city'), ('york', 'B-city')],
+    [('a', 'O'), ('big', 'O'), ('dog', 'B-animal')]
+]
+
+
+def test_conlleval():
+    res = evaluate(_ref, _hyp)
+    assert res['total']['s'] == 3
+    assert res['total']['p'] == 1 / 4 and res['total']['r'] == 1 / 3
+    assert res['animal']['p'] == 1 / 2 and res['city']['p'] == 0
+
+    # lookup table agrees with boundary functions
+    for (prev_iob, iob, changed), bounds in chunk_table().items():
+        lbl, prev_lbl = ('x', 'y') if changed else ('x', 'x')
+        assert bounds == (is_boc(lbl, iob, prev_lbl, prev_iob), is_eoc(lbl, iob, prev_lbl, prev_iob))
+
+    assert parse_iob('B-city') == ('B', 'city') and parse_iob('O') == ('O', None)
+
+
+def test_evaluate_stream():
+    import os
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        files = []
+        for name, data in [('ref', _ref), ('hyp', _hyp)]:
+            files.append(os.path.join(tmp, name + '.conll'))
+            with open(files[-1], 'w') as f:
+                f.write("".join(["\n".join(["\t".join(token) for token in sent]) + "\n\n" for sent in data]))
+
+        assert read_corpus_conll(files[0]) == _ref
+        assert read_corpus_conll(files[0], columns=[1]) == [[token[1:] for token in sent] for sent in _ref]
+        assert read_corpus_conll(files[0], columns=[1, 0]) == [[token[::-1] for token in sent] for sent in _ref]
+        assert get_chunks(files[0]) == {'animal', 'city'}
+
+        assert evaluate_stream(*files) == evaluate(_ref, _hyp)
+        assert evaluate_stream(files[0], iter(_hyp)) == evaluate(_ref, _hyp)
+
+        for hyp in [_hyp[:1], [_hyp[0], _hyp[1][:2]]]:
+            try:
+                evaluate_stream(files[0], hyp)
+                assert False
+            except ValueError:
+                pass
+
+
+def test_merge():
+    aligned = align_hyp(_ref, _hyp)
+    counts = EvalCounts()
+    counts.add(aligned[0])
+    shard = EvalCounts()
+    shard.add(aligned[1])
+    assert counts.merge(shard).summarize() == conlleval(aligned)
+    assert evaluate(_ref * 3, _hyp * 3, workers=2) == evaluate(_ref * 3, _hyp * 3)
+
+
+def test_bootstrap():
+    ref, hyp = _ref * 10, _hyp * 10
+    observed = evaluate(ref, hyp)
+    ci = bootstrap(ref, hyp, n=200, seed=1)
+    assert set(ci.keys()) == set(observed.keys())
+    for lbl in ci:
+        for key in ['p', 'r', 'f']:
+            assert ci[lbl][key][0] <= observed[lbl][key] <= ci[lbl][key][1]
+    assert bootstrap(ref, hyp, n=200, seed=1) == ci
+
+    assert bootstrap_compare(ref, hyp, hyp, n=50, seed=1) == {'delta': 0.0, 'p': 1.0}
+    res = bootstrap_compare(ref, ref, hyp, n=50, seed=1)
+    assert res['delta'] > 0 and res['p'] == 0.0
+
+    # blocks of samples (numpy) score the same as lists of indices
+    try:
+        import numpy as np
+    except ImportError:
+        return
+    vectors = sentence_counts(ref, hyp)
+    block = np.random.default_rng(1).integers(0, len(ref), size=(20, len(ref)))
+    assert resample(vectors, [block[:5], block[5:]]) == resample(vectors, block.tolist())
+
+
+def test_read_cache():
+    import os
+    import tempfile
+    from cache import Sentences
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ref.conll')
+        with open(path, 'w') as f:
+            f.write("".join(["\n".join(["\t".join(token) for token in sent]) + "\n\n" for sent in _ref]))
+
+        # first read parses the file & writes the cache, second read loads it
+        assert read_corpus_conll(path, cache=True) == _ref
+        assert os.path.exists(path + '.cache')
+        cached = read_corpus_conll(path, cache=True)
+        assert isinstance(cached, Sentences) and cached == _ref and len(cached) == len(_ref)
+        assert evaluate(cached, _hyp) == evaluate(_ref, _hyp)
+        cached = read_corpus_conll(path, columns=[-1], cache=True)
+        assert isinstance(cached, Sentences) and cached == [[t[-1:] for t in s] for s in _ref]
+
+        # out-of-range columns are an error with & without cache
+        for _ in range(2):
+            try:
+                read_corpus_conll(path, columns=[len(_ref[0][0])], cache=True)
+                assert False
+            except IndexError:
+                pass
+
+        # empty file
+        path = os.path.join(tmp, 'empty.conll')
+        open(path, 'w').close()
+        for i in range(2):
+            assert list(read_corpus_conll(path, columns=[-1], cache=True)) == []
+
+
+if __name__ == '__main__':
+    print("Testing Only...")
+    test_conlleval()
+    test_evaluate_stream()
+    test_merge()
+    test_bootstrap()
+    test_read_cache()
+    print("Done!")
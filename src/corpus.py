@@ -1,17 +1,101 @@
+class TrackedSet(set):
+    """
+    set that calls a callback after every in-place change (e.g. to reset caches computed from it)
+    """
+
+    def __init__(self, iterable=(), callback=None):
+        super(TrackedSet, self).__init__(iterable)
+        self.callback = callback
+
+    def changed(self):
+        # no callback yet while unpickling
+        callback = getattr(self, 'callback', None)
+        if callback is not None:
+            callback()
+
+
+def _tracked(cls, name):
+    # wrap an in-place method of a tracked container: callback after the change
+    method = getattr(cls.__bases__[0], name)
+
+    def tracked(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.changed()
+        return result
+    tracked.__name__ = name
+    setattr(cls, name, tracked)
+
+
+for _name in ['add', 'discard', 'remove', 'pop', 'clear', 'update', 'difference_update', 'intersection_update',
+              'symmetric_difference_update', '__ior__', '__iand__', '__isub__', '__ixor__']:
+    _tracked(TrackedSet, _name)
+
+
+class TrackedDict(dict):
+    """
+    dict that calls a callback after every in-place change (e.g. to reset caches computed from it)
+    """
+
+    def __init__(self, mapping=(), callback=None):
+        super(TrackedDict, self).__init__(mapping)
+        self.callback = callback
+
+    def changed(self):
+        # no callback yet while unpickling
+        callback = getattr(self, 'callback', None)
+        if callback is not None:
+            callback()
+
+
+for _name in ['__setitem__', '__delitem__', 'pop', 'popitem', 'clear', 'update', 'setdefault'] + \
+        (['__ior__'] if hasattr(dict, '__ior__') else []):
+    _tracked(TrackedDict, _name)
+
+
 class Lexicon(object):
 
-    def __init__(self, corpus=None):
+    def __init__(self, corpus=None, weights=None):
+        self.ranked = None      # frequency index: tokens by decreasing frequency (ties by token) & -frequencies
+        self.vocabulary = None  # sorted lexicon
         self.lexicon = None
         self.frequencies = None
+        self.ids = {}     # token -> id (stable: ids are never reassigned)
+        self.tokens = []  # id -> token
 
-        if corpus:
-            self.create(corpus)
+        if corpus is not None:
+            self.create(corpus, weights=weights)
+
+    @property
+    def lexicon(self):
+        # in-place changes of the set reset the sorted lexicon
+        return self._lexicon
+
+    @lexicon.setter
+    def lexicon(self, value):
+        self._lexicon = TrackedSet(value, callback=self.lexicon_changed) if value is not None else None
+        self.vocabulary = None
+
+    @property
+    def frequencies(self):
+        # in-place changes of the dict reset the frequency index
+        return self._frequencies
+
+    @frequencies.setter
+    def frequencies(self, value):
+        self._frequencies = TrackedDict(value, callback=self.frequencies_changed) if value is not None else None
+        self.ranked = None
+
+    def lexicon_changed(self):
+        self.vocabulary = None
+
+    def frequencies_changed(self):
+        self.ranked = None
 
     def __eq__(self, other):
-        return self.lexicon == other
+        return self._lexicon == other
 
     def __iter__(self):
-        for token in sorted(list(self.lexicon)):
+        for token in self.sorted_lexicon():
             yield token
 
     def __set__(self, instance, value):
@@ -21,36 +105,104 @@ class Lexicon(object):
         return self.instance
 
     def __len__(self):
-        return len(self.lexicon)
+        return len(self._lexicon)
 
     def __str__(self):
-        return "\n".join(sorted(list(self.lexicon)))
+        return "\n".join(self.sorted_lexicon())
 
-    def create(self, corpus):
+    def create(self, corpus, weights=None):
         """
         compute lexicon of a corpus
         :param corpus: corpus as list-of-lists
+        :param weights: sentence occurrence counts (deduplicated corpus); default corpus.weights, if any
+        """
+        self.compute_frequency_list(corpus, weights=weights)
+        self.lexicon = set(self._frequencies)
+        for token in self._frequencies:
+            self.intern(token)
+
+    def from_frequencies(self, frequencies):
         """
-        self.lexicon = set([word for sent in corpus for word in sent])
-        self.compute_frequency_list(corpus)
+        create lexicon from a frequency list (e.g. a cached one)
+        :param frequencies: iterable of (token, frequency) pairs
+        """
+        self.frequencies = dict(frequencies)
+        self.lexicon = set(self._frequencies)
+        for token in self._frequencies:
+            self.intern(token)
 
-    def compute_frequency_list(self, corpus):
+    def compute_frequency_list(self, corpus, weights=None):
         """
         create frequency list for a corpus
         :param corpus: corpus as list of lists
+        :param weights: sentence occurrence counts (deduplicated corpus); default corpus.weights, if any
         """
+        weights = weights if weights is not None else getattr(corpus, 'weights', None)
         frequencies = {}
-        for sent in corpus:
+        for sent, weight in zip(corpus, weights) if weights else ((sent, 1) for sent in corpus):
             for token in sent:
-                frequencies[token] = frequencies.setdefault(token, 0) + 1
+                frequencies[token] = frequencies.setdefault(token, 0) + weight
         self.frequencies = frequencies
 
+    def update(self, corpus, weights=None):
+        """
+        add tokens & frequencies of new sentences to lexicon
+        :param corpus: corpus as list of lists
+        :param weights: sentence occurrence counts (deduplicated corpus); default corpus.weights, if any
+        """
+        weights = weights if weights is not None else getattr(corpus, 'weights', None)
+        if self._lexicon is None:
+            self.lexicon = set()
+        if self._frequencies is None:
+            self.frequencies = {}
+
+        # counts of new sentences are merged in bulk (a single change of the tracked set & dict)
+        counts = {}
+        for sent, weight in zip(corpus, weights) if weights else ((sent, 1) for sent in corpus):
+            for token in sent:
+                counts[token] = counts.setdefault(token, 0) + weight
+        for token, count in counts.items():
+            counts[token] = self._frequencies.get(token, 0) + count
+            self.intern(token)
+        self._frequencies.update(counts)
+        self._lexicon.update(counts)
+
     def add(self, token):
-        self.lexicon.add(token)
+        if token not in self._lexicon:
+            self._lexicon.add(token)
+        self.intern(token)
+
+    def intern(self, token):
+        """
+        get token id, assigning the next free id to new tokens (lexicon membership is not changed)
+        :param token: token
+        :return: id
+        """
+        tid = self.ids.get(token)
+        if tid is None:
+            tid = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return tid
+
+    def encode(self, sent):
+        """
+        encode a sentence as a list of token ids
+        :param sent: list of tokens
+        :return: list of ids
+        """
+        return [self.intern(token) for token in sent]
+
+    def decode(self, ids):
+        """
+        decode a sentence of token ids
+        :param ids: list of ids
+        :return: list of tokens
+        """
+        return [self.tokens[tid] for tid in ids]
 
     def rm(self, token):
-        if token in self.lexicon:
-            self.lexicon.remove(token)
+        if token in self._lexicon:
+            self._lexicon.remove(token)
 
     def read(self, lexicon_file):
         """
@@ -58,6 +210,8 @@ class Lexicon(object):
         :param lexicon_file: lexicon file in token-per-line format
         """
         self.lexicon = set([line.strip() for line in open(lexicon_file, 'r')])
+        for token in self.sorted_lexicon():
+            self.intern(token)
 
     def write(self, lexicon_file):
         """
@@ -65,7 +219,7 @@ class Lexicon(object):
         :param lexicon_file: lexicon file
         """
         with open(lexicon_file, 'w') as f:
-            f.write("\n".join(sorted(list(self.lexicon))) + "\n")
+            f.write("\n".join(self.sorted_lexicon()) + "\n")
 
     def cutoff(self, tf_min=1, tf_max=float('inf'), update=False):
         """
@@ -75,8 +229,11 @@ class Lexicon(object):
         :param tf_max: maximum token frequency for lexicon elements (above removed); default infinity
         :param update: if to update lexicon (i.e. not to recreate it)
         """
-        lexicon = set([token for token, frequency in self.frequencies.items() if tf_max >= frequency >= tf_min])
-        self.lexicon = self.lexicon - (self.lexicon - lexicon) if update else lexicon
+        from bisect import bisect_left, bisect_right
+        tokens, frequencies = self.index()
+        # frequencies are negated (ascending), so [tf_min, tf_max] is a contiguous range of the index
+        lexicon = set(tokens[bisect_left(frequencies, -tf_max):bisect_right(frequencies, -tf_min)])
+        self.lexicon = self._lexicon & lexicon if update else lexicon
 
     def remove(self, stopwords=None):
         """
@@ -84,18 +241,271 @@ class Lexicon(object):
         :param stopwords: stopwords list
         """
         if stopwords:
-            self.lexicon = self.lexicon - set(stopwords)
+            self.lexicon = self._lexicon - set(stopwords)
+
+    def invalidate(self):
+        """
+        reset sorted lexicon & frequency index; assignments & in-place changes of the lexicon set or frequency dict
+        reset them already
+        """
+        self.vocabulary = None
+        self.ranked = None
+
+    def sorted_lexicon(self):
+        """
+        sorted lexicon (computed on first use after a lexicon change)
+        :return: list of tokens
+        """
+        if self.vocabulary is None:
+            self.vocabulary = sorted(self._lexicon)
+        return self.vocabulary
+
+    def index(self):
+        """
+        frequency-ranked index of the frequency list
+        (computed on first use after a frequency change)
+        :return: tuple of tokens by decreasing frequency (ties by token) & their negated frequencies (ascending)
+        """
+        if self.ranked is None:
+            items = sorted(self._frequencies.items(), key=lambda item: (-item[1], item[0]))
+            self.ranked = ([token for token, frequency in items], [-frequency for token, frequency in items])
+        return self.ranked
+
+    def top(self, k=1):
+        """
+        most frequent tokens of the frequency list
+        :param k: number of tokens
+        :return: list of k tokens by decreasing frequency (ties by token)
+        """
+        return self.index()[0][:k]
+
+    def rank(self, token):
+        """
+        frequency rank of a token: 1 + number of tokens with higher frequency (tokens with equal frequency share it)
+        :param token: token
+        :return: rank; None if token is not in frequency list
+        """
+        from bisect import bisect_left
+        if token not in self._frequencies:
+            return None
+        return 1 + bisect_left(self.index()[1], -self._frequencies[token])
+
+
+class Stream(object):
+    """
+    lazy corpus: sentences are read from a file (or an iterable) & passed through processing stages only when
+    iterated; every iteration is a new single pass over the source
+    """
+
+    def __init__(self, source, stages=None):
+        self.source = source        # corpus file or iterable of sentences (strings or token lists)
+        self.stages = stages or []  # functions from iterable of sentences to iterable of sentences
+
+    def __set__(self, instance, value):
+        self.instance = value
+
+    def __get__(self, instance, owner):
+        return self.instance
+
+    def __iter__(self):
+        sents = self.tokenize(self.source)
+        for stage in self.stages:
+            sents = stage(sents)
+        for sent in sents:
+            yield sent
+
+    @staticmethod
+    def tokenize(source):
+        """
+        split sentences into tokens by space (' ')
+        :param source: corpus file in sentence-per-line format (tokenized) or iterable
+        :return: generator of token lists
+        """
+        if isinstance(source, str):
+            with open(source, 'r') as f:
+                for line in f:
+                    yield line.strip().split()
+        else:
+            for sent in source:
+                yield sent.strip().split() if isinstance(sent, str) else list(sent)
+
+    def map(self, stage):
+        """
+        add processing stage
+        :param stage: function from iterable of sentences to iterable of sentences
+        :return: new stream
+        """
+        return Stream(self.source, self.stages + [stage])
+
+
+class EncodedCorpus(object):
+    """
+    compact corpus: flat array of token ids (from lexicon) with sentence offsets; tokens are decoded on demand
+    """
+
+    def __init__(self, lexicon, corpus=None, weights=None):
+        from array import array
+        self.lexicon = lexicon              # Lexicon providing token <-> id mapping
+        self.ids = array('i')               # token ids of all sentences
+        self.offsets = array('q', [0])      # sentence i is ids[offsets[i]:offsets[i+1]]
+        self.weights = None                 # sentence occurrence counts (deduplicated corpus)
+
+        if corpus:
+            self.encode(corpus, weights=weights)
+
+    def __set__(self, instance, value):
+        self.instance = value
+
+    def __get__(self, instance, owner):
+        return self.instance
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.lexicon.decode(self.sentence(i))
+
+    def __eq__(self, other):
+        return list(self) == other
+
+    def sentence(self, i):
+        """
+        token ids of a sentence
+        :param i: sentence index
+        :return: array of ids
+        """
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def encode(self, corpus, weights=None):
+        """
+        append sentences to the encoding
+        :param corpus: corpus as list-of-lists
+        :param weights: sentence occurrence counts (deduplicated corpus)
+        """
+        size = len(self)
+        for sent in corpus:
+            self.ids.extend(map(self.lexicon.intern, sent))
+            self.offsets.append(len(self.ids))
+
+        if weights or self.weights:
+            self.weights = (self.weights or [1] * size) + (list(weights) if weights else [1] * (len(self) - size))
+
+    def decode(self):
+        """
+        decode corpus
+        :return: corpus as list-of-lists
+        """
+        return list(self)
+
+    def frequencies(self):
+        """
+        compute frequency list from token ids (token counts of a sentence are multiplied by its weight);
+        with numpy ids are counted with bincount (weights repeated over the tokens of every sentence)
+        :return: frequency dict
+        """
+        from collections import Counter
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+
+        if np is not None:
+            ids = np.frombuffer(self.ids, dtype=np.intc)
+            if self.weights:
+                weights = np.repeat(np.asarray(self.weights, dtype=np.float64), np.diff(self.offsets))
+                counts = np.bincount(ids, weights=weights)
+            else:
+                counts = np.bincount(ids)
+            return {self.lexicon.tokens[tid]: int(counts[tid]) for tid in np.flatnonzero(np.bincount(ids))}
+
+        if self.weights:
+            counts = Counter()
+            for i, weight in enumerate(self.weights):
+                for tid, count in Counter(self.sentence(i)).items():
+                    counts[tid] += count * weight
+        else:
+            counts = Counter(self.ids)
+        return {self.lexicon.tokens[tid]: count for tid, count in counts.items()}
+
+    def pad(self, bos='<s>', eos='</s>', bosn=1, eosn=1):
+        """
+        add beginning-of-sentence (bos) or/and end-of-sentence (eos) tags
+        :param bos: beginning-of-sentence tag
+        :param eos: end-of-sentence tag
+        :param bosn: number of bos to add
+        :param eosn: number of eos to add
+        """
+        from array import array
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+
+        self.lexicon.add(bos)
+        self.lexicon.add(eos)
+        n = bosn + eosn
+
+        if np is not None:
+            # tokens move by n per preceding sentence; tags fill the first bosn & last eosn slots of every sentence
+            ids = np.frombuffer(self.ids, dtype=np.intc)
+            offsets = np.frombuffer(self.offsets, dtype=np.int64) + np.arange(len(self.offsets)) * n
+            padded = np.empty(len(ids) + len(self) * n, dtype=np.intc)
+            sents = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+            padded[np.arange(len(ids)) + sents * n + bosn] = ids
+            padded[(offsets[:-1, None] + np.arange(bosn)).ravel()] = self.lexicon.ids[bos]
+            padded[(offsets[1:, None] - eosn + np.arange(eosn)).ravel()] = self.lexicon.ids[eos]
+            self.ids = array('i', padded.tobytes())
+            self.offsets = array('q', offsets.tobytes())
+            return
+
+        head = array('i', [self.lexicon.ids[bos]] * bosn)
+        tail = array('i', [self.lexicon.ids[eos]] * eosn)
+
+        ids = array('i')
+        for i in range(len(self)):
+            ids.extend(head)
+            ids.extend(self.sentence(i))
+            ids.extend(tail)
+
+        self.ids = ids
+        self.offsets = array('q', (offset + i * n for i, offset in enumerate(self.offsets)))
+
+    def oov(self, unk='<unk>'):
+        """
+        replace all tokens that are not in lexicon with OOV symbol (via id -> id table; with numpy table[ids])
+        :param unk: OOV (unknown) symbol
+        """
+        from array import array
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+
+        uid = self.lexicon.intern(unk)
+        lexicon = self.lexicon.lexicon
+        table = [tid if token in lexicon else uid for tid, token in enumerate(self.lexicon.tokens)]
+        if np is not None:
+            ids = np.asarray(table, dtype=np.intc)[np.frombuffer(self.ids, dtype=np.intc)]
+            self.ids = array('i', ids.tobytes())
+        else:
+            self.ids = array('i', map(table.__getitem__, self.ids))
+        self.lexicon.add(unk)
 
 
 class Corpus(object):
 
-    def __init__(self, corpus_file=None):
+    def __init__(self, corpus_file=None, lazy=False, cache=False, dedup=False):
         self.corpus = None
         self.lexicon = None
+        self.weights = None  # sentence occurrence counts (deduplicated corpus)
 
-        if corpus_file:
-            self.read(corpus_file)
-            self.lexicon = Lexicon(corpus=self.corpus)
+        if corpus_file and lazy and dedup:
+            raise ValueError("Deduplication requires reading the corpus (lazy=False)")
+        elif corpus_file and lazy:
+            self.open(corpus_file)
+        elif corpus_file:
+            self.read(corpus_file, cache=cache, dedup=dedup)
 
     def __set__(self, instance, value):
         self.instance = value
@@ -110,31 +520,111 @@ class Corpus(object):
         return out
 
     def __len__(self):
+        # a stream is read on every pass: its length is unknown without reading it (use sum(1 for _ in corpus))
+        if isinstance(self.corpus, Stream):
+            raise TypeError("Length of a lazy corpus is unknown (stream is not read)")
         return len(self.corpus)
 
     def __eq__(self, other):
-        return self.corpus == other
+        return (list(self.corpus) if isinstance(self.corpus, Stream) else self.corpus) == other
 
     def __iter__(self):
         for sent in self.corpus:
             yield sent
 
-    def read(self, corpus_file):
+    def read(self, corpus_file, cache=False, dedup=False):
         """
         read corpus into a list-of-lists, splitting sentences into tokens by space (' ')
         :param corpus_file: corpus file in sentence-per-line format (tokenized)
+        :param cache: read parsed corpus from (or write it to) columnar cache next to corpus file;
+            a cached corpus is a sequence of sentences decoded on access (cache.Sentences)
+        :param dedup: keep unique sentences only, with occurrence counts as weights (sentences are counted as
+            token tuples, so lines differing only in spacing are one sentence; with cache, the cached corpus is
+            deduplicated)
         """
+        self.weights = None
+        if dedup and not cache:
+            from collections import Counter
+            with open(corpus_file, 'r') as f:
+                lines = Counter(tuple(line.split()) for line in f)
+            self.corpus = [list(sent) for sent in lines]
+            self.weights = list(lines.values())
+            self.lexicon = Lexicon(corpus=self.corpus, weights=self.weights)
+            return
+
+        if cache:
+            from cache import load
+            cached = load(corpus_file, flat=True, format='corpus')
+            if cached is not None:
+                # sentences are decoded on access; lexicon is restored from cached frequencies
+                self.corpus = cached
+                self.lexicon = Lexicon()
+                self.lexicon.from_frequencies(zip(cached.vocabs[0], cached.meta['frequencies']))
+                if dedup:
+                    self.dedup()
+                return
+
         self.corpus = [line.strip().split() for line in open(corpus_file, 'r')]
         self.lexicon = Lexicon(corpus=self.corpus)
 
+        if cache:
+            from itertools import chain
+            from cache import dump
+            offsets = [0]
+            for sent in self.corpus:
+                offsets.append(offsets[-1] + len(sent))
+            # cache vocabulary & lexicon frequencies are both in first occurrence order
+            dump(corpus_file, [list(chain.from_iterable(self.corpus))], offsets,
+                 meta={'frequencies': list(self.lexicon.frequencies.values())}, format='corpus')
+
+        if dedup:
+            self.dedup()
+
+    def dedup(self):
+        """
+        collapse repeated sentences: corpus keeps unique sentences (in first occurrence order)
+        & weights their occurrence counts; lexicon frequencies are unchanged
+        """
+        weights = self.weights if self.weights else (1 for _ in self.corpus)
+        counts = {}
+        for sent, weight in zip(self.corpus, weights):
+            key = tuple(sent)
+            counts[key] = counts.get(key, 0) + weight
+        self.corpus = [list(sent) for sent in counts]
+        self.weights = list(counts.values())
+
+    def expand(self):
+        """
+        expand deduplicated corpus: every sentence is repeated by its weight
+        :return: corpus as list-of-lists
+        """
+        if not self.weights:
+            return list(self.corpus)
+        return [list(sent) for sent, weight in zip(self.corpus, self.weights) for _ in range(weight)]
+
+    def encode(self):
+        """
+        encode corpus as a flat array of token ids (lexicon ids) with sentence offsets
+        :return: EncodedCorpus
+        """
+        self.lexicon = self.lexicon if self.lexicon is not None else Lexicon()
+        return EncodedCorpus(self.lexicon, corpus=self.corpus, weights=self.weights)
+
+    def open(self, source):
+        """
+        open corpus as a lazy stream; lexicon is not computed (set it, e.g. to Lexicon(self.corpus), before oov)
+        :param source: corpus file in sentence-per-line format (tokenized) or iterable of sentences
+        """
+        self.corpus = Stream(source)
+
     def write(self, corpus_file):
         """
         write corpus in a list-of-lists into a file
         :param corpus_file: corpus file for writing
         """
         with open(corpus_file, 'w') as f:
-            for sent in self.corpus:
-                f.write(" ".join(sent) + "\n")
+            for sent, weight in zip(self.corpus, self.weights) if self.weights else ((s, 1) for s in self.corpus):
+                f.write((" ".join(sent) + "\n") * weight)
 
     def pad(self, data=None, bos='<s>', eos='</s>', bosn=1, eosn=1):
         """
@@ -148,26 +638,37 @@ class Corpus(object):
         :param bosn: number of bos to add
         :param eosn: number of eos to add
 
-        :return: processed corpus as list of lists
+        :return: processed corpus as list of lists (stream for streams)
         """
+        def stage(sents):
+            return ([bos] * bosn + sent + [eos] * eosn for sent in sents)
+
         if data:
-            return [[bos] * bosn + sent + [eos] * eosn for sent in data]
+            return data.map(stage) if isinstance(data, Stream) else list(stage(data))
         else:
-            self.corpus = [[bos] * bosn + sent + [eos] * eosn for sent in self.corpus]
-            self.lexicon.add(bos)
-            self.lexicon.add(eos)
+            self.corpus = self.corpus.map(stage) if isinstance(self.corpus, Stream) else list(stage(self.corpus))
+            if self.lexicon is not None:
+                self.lexicon.add(bos)
+                self.lexicon.add(eos)
 
     def oov(self, data=None,  unk='<unk>'):
         """
         replace all tokens that are not in lexicon with OOV symbol
         :param data: corpus to process & return (usually test)
         :param unk: OOV (unknown) symbol
-        :return: processed corpus
+        :return: processed corpus (stream for streams)
         """
+        if self.lexicon is None:
+            raise ValueError("OOV replacement requires a lexicon (for a lazy corpus: Lexicon(corpus.corpus))")
+        lexicon = set(self.lexicon.lexicon)  # lexicon at call time (streams are processed later)
+
+        def stage(sents):
+            return ([token if token in lexicon else unk for token in sent] for sent in sents)
+
         if data:
-            return [[token if token in self.lexicon else unk for token in sent] for sent in data]
+            return data.map(stage) if isinstance(data, Stream) else list(stage(data))
         else:
-            self.corpus = [[token if token in self.lexicon else unk for token in sent] for sent in self.corpus]
+            self.corpus = self.corpus.map(stage) if isinstance(self.corpus, Stream) else list(stage(self.corpus))
             self.lexicon.add(unk)
 
 
@@ -200,8 +701,8 @@ def test_lexicon():
     assert len(lex) == 13
 
     # Type checking
-    assert type(lex.frequencies) == dict
-    assert type(lex.lexicon) == set
+    assert isinstance(lex.frequencies, dict)
+    assert isinstance(lex.lexicon, set)
 
     # Testing set add/rm operations
     assert _unk not in lex
@@ -235,6 +736,62 @@ def test_lexicon():
     assert lex == {'cat'}
 
 
+def test_lexicon_index():
+    lex = Lexicon(_corpus)
+    assert list(lex) == sorted(_lexicon) and str(lex) == "\n".join(sorted(_lexicon))
+
+    # sorted lexicon follows lexicon changes
+    lex.add(_unk)
+    assert list(lex) == sorted(_lexicon | {_unk})
+    lex.rm(_unk)
+    lex.remove(_stopwords)
+    assert list(lex) == sorted(_lexicon - set(_stopwords))
+
+    assert lex.top(3) == ['is', 'the', 'cat']
+    assert lex.top(100) == sorted(_freq, key=lambda token: (-_freq[token], token))
+    assert [lex.rank(token) for token in ['is', 'the', 'cat', 'a', 'closet']] == [1, 1, 3, 4, 4]
+    assert lex.rank(_unk) is None
+
+    # cutoffs agree with a frequency list scan for every threshold
+    for tf_min in range(0, 6):
+        for tf_max in [tf_min, tf_min + 1, float('inf')]:
+            lex.cutoff(tf_min=tf_min, tf_max=tf_max)
+            assert lex == {token for token, f in _freq.items() if tf_max >= f >= tf_min}
+            assert list(lex) == sorted(lex.lexicon)
+
+    # index follows frequency updates
+    lex.update([['cat', 'cat', 'cat']])
+    assert lex.top(1) == ['cat'] and lex.rank('is') == 2
+
+    # reading the lexicon set & frequency dict keeps the index; in-place changes reset it
+    ranked = lex.index()
+    assert lex.lexicon is lex.lexicon and lex.frequencies['cat'] == 5 and lex.index() is ranked
+    lex.lexicon.add('zzz')
+    lex.frequencies['q'] = 9
+    assert list(lex)[-1] == 'zzz' and str(lex).endswith('zzz')
+    assert lex.top(1) == ['q'] and lex.rank('cat') == 2
+    lex.lexicon -= {'zzz'}
+    del lex.frequencies['q']
+    assert 'zzz' not in list(lex) and lex.top(1) == ['cat']
+    lex.lexicon = {'b', 'a'}
+    lex.frequencies = {'b': 1, 'a': 1}
+    assert list(lex) == ['a', 'b'] and lex.top(2) == ['a', 'b']
+
+
+def test_lexicon_update():
+    lex = Lexicon(_corpus[:2])
+    lex.update(_corpus[2:])
+    full = Lexicon(_corpus)
+
+    assert lex == _lexicon
+    assert lex.frequencies == _freq
+    assert lex.tokens == full.tokens
+
+    lex = Lexicon()
+    lex.update(_corpus)
+    assert lex == _lexicon and lex.frequencies == _freq
+
+
 def test_corpus():
     corp = Corpus()
     corp.corpus = _corpus
@@ -283,9 +840,174 @@ def test_corpus_external():
     assert sent_pro == [['<s>', '<unk>', 'cat', '</s>']]
 
 
+def test_corpus_stream():
+    import os
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'corpus.txt')
+        with open(path, 'w') as f:
+            f.write("\n".join([" ".join(sent) for sent in _corpus]) + "\n")
+
+        corp = Corpus(path)
+        lazy = Corpus(path, lazy=True)
+
+        assert isinstance(lazy.corpus, Stream)
+        assert lazy == _corpus and sum(1 for _ in lazy) == 4
+        try:
+            len(lazy)
+            assert False
+        except TypeError:
+            pass
+
+        # lexicon in a single pass over the stream (required for oov)
+        try:
+            lazy.oov()
+            assert False
+        except ValueError:
+            pass
+        lazy.lexicon = Lexicon(lazy.corpus)
+        assert lazy.lexicon == _lexicon and lazy.lexicon.frequencies == _freq
+
+        for c in [corp, lazy]:
+            c.lexicon.remove(_stopwords)
+            c.oov()
+            c.pad()
+        assert isinstance(lazy.corpus, Stream)
+        assert lazy == corp.corpus
+
+        # stages are applied lazily to external streams too
+        sent = Stream(iter(["my cat"]))
+        assert list(corp.pad(data=corp.oov(data=sent))) == [['<s>', '<unk>', 'cat', '</s>']]
+
+
+def test_corpus_encoded():
+    corp = Corpus()
+    corp.corpus = _corpus
+    corp.lexicon = Lexicon(_corpus)
+
+    # stable token <-> id mapping
+    ids = corp.lexicon.encode(['the', 'cat'])
+    assert corp.lexicon.decode(ids) == ['the', 'cat']
+    corp.lexicon.rm('the')
+    assert corp.lexicon.encode(['the', 'cat']) == ids
+
+    enc = corp.encode()
+    assert isinstance(enc, EncodedCorpus)
+    assert len(enc) == 4 and len(enc.ids) == 20
+    assert enc == _corpus
+    corp.lexicon.add('the')
+    assert enc.frequencies() == _freq
+
+    # same processing as on the list-of-lists corpus
+    corp.lexicon.remove(_stopwords)
+    enc.oov()
+    enc.pad(bosn=2)
+    corp.oov()
+    corp.pad(bosn=2)
+    assert enc.decode() == corp.corpus
+
+    # empty sentences & weighted frequencies
+    corp.corpus = [[], ['the', 'cat', 'is'], [], ['a', 'cat']]
+    enc = EncodedCorpus(corp.lexicon, corpus=corp.corpus, weights=[1, 3, 1, 2])
+    assert enc.frequencies() == {'the': 3, 'cat': 5, 'is': 3, 'a': 2}
+    enc.oov()
+    enc.pad(bosn=1, eosn=2)
+    corp.oov()
+    corp.pad(bosn=1, eosn=2)
+    assert enc.decode() == corp.corpus and list(enc.offsets) == [0, 3, 9, 12, 17]
+
+
+def test_corpus_dedup():
+    import os
+    import tempfile
+    repetitive = _corpus * 3 + _corpus[:2]
+
+    corp = Corpus()
+    corp.corpus = list(repetitive)
+    corp.dedup()
+    assert corp.corpus == _corpus and corp.weights == [4, 4, 3, 3]
+    assert sorted(corp.expand()) == sorted(repetitive)
+    assert Lexicon(corp.corpus, weights=corp.weights).frequencies == Lexicon(repetitive).frequencies
+
+    # padding & oov keep weights aligned with sentences
+    corp.lexicon = Lexicon(corp.corpus, weights=corp.weights)
+    corp.pad()
+    assert len(corp) == len(corp.weights) == 4
+
+    # encoded corpus carries weights
+    enc = corp.encode()
+    assert enc.weights == corp.weights and enc.frequencies() == Lexicon(corp.expand()).frequencies
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'corpus.txt')
+        full = Corpus()
+        full.corpus = repetitive
+        full.write(path)
+
+        dedup = Corpus(path, dedup=True)
+        assert dedup.corpus == _corpus and dedup.weights == [4, 4, 3, 3]
+        assert dedup.lexicon.frequencies == Corpus(path).lexicon.frequencies
+        assert Lexicon(dedup).frequencies == dedup.lexicon.frequencies
+
+        # lines differing only in spacing are the same sentence
+        spaced = os.path.join(tmp, 'spaced.txt')
+        with open(spaced, 'w') as f:
+            f.write("the cat is fat\nthe  cat is   fat \n")
+        assert Corpus(spaced, dedup=True).weights == [2]
+
+        # cached corpus is deduplicated on both cache miss & hit; lazy streams cannot be deduplicated
+        for _ in range(2):
+            cached = Corpus(path, cache=True, dedup=True)
+            assert cached.corpus == _corpus and cached.weights == [4, 4, 3, 3]
+            assert cached.lexicon.frequencies == dedup.lexicon.frequencies
+            assert os.path.exists(path + '.cache')
+        try:
+            Corpus(path, lazy=True, dedup=True)
+            assert False
+        except ValueError:
+            pass
+
+        # writing expands sentences back (grouped by sentence); lexicon update reads weights too
+        lex = Lexicon()
+        lex.update(dedup)
+        assert lex.frequencies == dedup.lexicon.frequencies
+        dedup.write(path)
+        assert Corpus(path) == dedup.expand() and sorted(dedup.expand()) == sorted(repetitive)
+
+
+def test_corpus_cache():
+    import os
+    import tempfile
+    from cache import Sentences
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'corpus.txt')
+        with open(path, 'w') as f:
+            f.write("\n".join([" ".join(sent) for sent in _corpus]) + "\n\n")
+
+        # first read parses the file & writes the cache, second read loads it
+        full = Corpus(path)
+        corp = Corpus(path, cache=True)
+        assert not isinstance(corp.corpus, Sentences) and os.path.exists(path + '.cache')
+        corp = Corpus(path, cache=True)
+        assert isinstance(corp.corpus, Sentences)
+        assert corp == _corpus + [[]] and len(corp) == 5
+        assert corp.lexicon == full.lexicon and corp.lexicon.frequencies == full.lexicon.frequencies
+        assert corp.lexicon.tokens == full.lexicon.tokens
+
+        corp.oov()
+        corp.pad()
+        assert corp.corpus[0] == ['<s>'] + _corpus[0] + ['</s>']
+
+
 if __name__ == '__main__':
     print("Testing Only...")
     test_lexicon()
+    test_lexicon_update()
+    test_lexicon_index()
     test_corpus()
     test_corpus_external()
+    test_corpus_stream()
+    test_corpus_cache()
+    test_corpus_encoded()
+    test_corpus_dedup()
     print("Done!")
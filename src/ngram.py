@@ -1,3 +1,8 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import perf_counter
+
+
 class Node(object):
 
     def __init__(self, word=None):
@@ -11,27 +16,139 @@ class Node(object):
     def __get__(self, instance, owner):
         return self.instance
 
+    def child(self, word):
+        return self.children.get(word)
+
+
+class ArrayNode(object):
+
+    def __init__(self, trie, order, index):
+        self.trie = trie    # ArrayTrie the node belongs to
+        self.order = order  # ngram order (0 for root)
+        self.index = index  # position within the order arrays
+
+    def __set__(self, instance, value):
+        self.instance = value
+
+    def __get__(self, instance, owner):
+        return self.instance
+
+    @property
+    def word(self):
+        return self.trie.vocab[self.trie.words[self.order][self.index]] if self.order else '*'
+
+    @property
+    def count(self):
+        return self.trie.counts[self.order][self.index]
+
+    @property
+    def probability(self):
+        return self.trie.probs[self.order][self.index]
+
+    @probability.setter
+    def probability(self, value):
+        self.trie.probs[self.order][self.index] = value
+
+    @property
+    def bow(self):
+        # back-off weight; only contexts with a weight have the attribute (NaN marks nodes without one)
+        bows = self.trie.bows
+        if self.order >= len(bows) or bows[self.order][self.index] != bows[self.order][self.index]:
+            raise AttributeError('bow')
+        return bows[self.order][self.index]
+
+    def child(self, word):
+        index = self.trie.find(self.order, self.index, word)
+        return ArrayNode(self.trie, self.order + 1, index) if index >= 0 else None
+
+    @property
+    def children(self):
+        lo, hi = self.trie.span(self.order, self.index)
+        return {self.trie.vocab[self.trie.words[self.order + 1][i]]: ArrayNode(self.trie, self.order + 1, i)
+                for i in range(lo, hi)}
+
 
 class Trie(object):
 
-    def __init__(self):
+    def __init__(self, trie=None):
         self.root = Node('*')  # trie root
         self.oov = Node()      # node for oov values
         self.size = 0          # depth of trie
 
+        # order statistics (updated by add & rm)
+        self.distinct = [1]           # number of nodes (distinct ngrams) per order; order 0 is root
+        self.count_of_counts = [{}]   # per order: count -> number of ngrams with that count
+        self.leaves = 1               # number of nodes without children (empty trie: root)
+
+        if trie:
+            self.build(trie)
+
     def __set__(self, instance, value):
         self.instance = value
 
     def __get__(self, instance, owner):
         return self.instance
 
-    def add(self, sequence):
+    def add(self, sequence, count=1):
         node = self.root
-        node.count += 1  # total word count
-        for word in sequence:
-            node.children[word] = node.children.setdefault(word, Node(word))
-            node = node.children[word]
-            node.count += 1
+        node.count += count  # total word count
+        for depth, word in enumerate(sequence, 1):
+            child = node.children.get(word)
+            if child is None:
+                # new leaf; parent (if it was a leaf) stops being one
+                self.leaves += 1 if node.children else 0
+                child = node.children[word] = Node(word)
+                if depth == len(self.distinct):
+                    self.distinct.append(0)
+                    self.count_of_counts.append({})
+                self.distinct[depth] += 1
+            else:
+                self.uncount(depth, child.count)
+            child.count += count
+            self.count_of_counts[depth][child.count] = self.count_of_counts[depth].get(child.count, 0) + 1
+            node = child
+
+    def build(self, trie):
+        """
+        build nodes from an ArrayTrie (counts & probabilities, together with model meta-information)
+        :param trie: ArrayTrie
+        """
+        pruned = getattr(trie, 'pruned', False)
+        self.leaves = 0
+        path = []  # nodes on the path from root to the current node
+        for depth, node, leaf in trie.walk():
+            del path[depth:]
+            if depth:
+                child = path[-1].children[node.word] = Node(node.word)
+                child.count = node.count
+                child.probability = node.probability
+                if pruned and hasattr(node, 'bow'):
+                    child.bow = node.bow
+                if depth == len(self.distinct):
+                    self.distinct.append(0)
+                    self.count_of_counts.append({})
+                self.distinct[depth] += 1
+                self.count_of_counts[depth][child.count] = self.count_of_counts[depth].get(child.count, 0) + 1
+            else:
+                child = self.root
+                child.count = node.count
+            self.leaves += 1 if leaf else 0
+            path.append(child)
+
+        # meta-information
+        self.size = trie.size
+        for attr in ['backoff', 'smoothing', 'weights', 'pruned']:
+            if hasattr(trie, attr):
+                setattr(self, attr, getattr(trie, attr))
+        if hasattr(trie.oov, 'probability'):
+            self.oov.probability = trie.oov.probability
+
+    def uncount(self, depth, count):
+        # remove a count from count-of-counts
+        counts = self.count_of_counts[depth]
+        counts[count] -= 1
+        if not counts[count]:
+            del counts[count]
 
     def get(self, sequence):
         node = self.root
@@ -39,34 +156,784 @@ class Trie(object):
             node = node.children.get(word, self.oov)
         return node
 
-    def traverse(self, node=None, sequence=None, size=None):
-        sequence = sequence if sequence else []
-        node = self.root if not node else node
+    def rm(self, sequence):
+        # remove node (with its children); counts of its ancestors are kept
+        parent = self.get(sequence[:-1])
+        if sequence and sequence[-1] in parent.children:
+            stack = [(len(sequence), parent.children.pop(sequence[-1]))]
+            while stack:
+                depth, node = stack.pop()
+                self.distinct[depth] -= 1
+                self.uncount(depth, node.count)
+                self.leaves -= 0 if node.children else 1
+                stack.extend((depth + 1, child) for child in node.children.values())
+            self.leaves += 0 if parent.children else 1
 
-        if not node.children:
-            yield sequence
+    def traverse(self, node=None, sequence=None, size=None):
+        stack = [(list(sequence) if sequence else [], self.root if not node else node)]
+        while stack:
+            sequence, node = stack.pop()
 
-        if size:
-            if len(sequence) == size:
+            if not node.children:
                 yield sequence
 
-        for word, n in node.children.items():
-            sequence.append(word)
-            yield from self.traverse(n, sequence, size=size)
-            sequence.pop()
+            if size:
+                if len(sequence) == size:
+                    yield sequence
+
+            stack.extend((sequence + [word], n) for word, n in reversed(node.children.items()))
+
+    def v(self, size=None):
+        # number of leaves & nodes of order size: len(list(self.traverse(size=size)))
+        return self.leaves + (self.distinct[size] if size and size < len(self.distinct) else 0)
+
+    def walk(self):
+        """
+        depth-first (pre-order) walk over trie nodes
+        :return: generator of (depth, node, is leaf) tuples
+        """
+        stack = [(0, self.root)]
+        while stack:
+            depth, node = stack.pop()
+            yield depth, node, not node.children
+            stack.extend((depth + 1, child) for child in node.children.values())
+
+    def nbytes(self):
+        """
+        estimated memory footprint of trie nodes (node objects, attribute & children dicts; words are shared)
+        :return: bytes
+        """
+        from sys import getsizeof
+        return sum(getsizeof(node) + getsizeof(node.__dict__) + getsizeof(node.children) for _, node, _ in self.walk())
+
+
+class ArrayTrie(object):
+    """
+    compact trie: words are encoded as integer ids & each order is stored as parallel arrays
+    (word id, count, log-prob, child offset), children of a node are sorted by word id
+    """
+
+    MAGIC = b'NGRAM\x00\x01\x00'  # binary format identifier & version
+    ARPA_ZERO = -99.0  # ARPA log10 value of zero probability
+
+    def __init__(self, trie=None):
+        self.vocab = []    # id -> word
+        self.ids = {}      # word -> id
+        self.words = []    # word ids per order
+        self.counts = []   # counts per order
+        self.probs = []    # log-probs per order
+        self.bows = []     # back-off weights (log) per order: Katz weights of models read from ARPA, or weights
+                           # of pruned contexts (NaN for other nodes) of pruned models
+        self.offsets = []  # per order: children of node i are in [offsets[i], offsets[i+1]) of the next order
+        self.oov = Node()  # node for oov values
+        self.size = 0      # depth of trie
+        self.buffer = None  # memory-mapped model file (if read with mmap)
+        self.index = None   # order statistics (computed from arrays on first use)
+        self.search = None  # sorted (parent, word id) keys per order for bulk lookup (stored or computed on first use)
+
+        if trie:
+            self.build(trie)
+
+    def __set__(self, instance, value):
+        self.instance = value
+
+    def __get__(self, instance, owner):
+        return self.instance
+
+    def build(self, trie):
+        """
+        build compact arrays from a Trie (together with model meta-information & back-off weights of pruned
+        contexts)
+        :param trie: Trie
+        """
+        from array import array
+        pruned = getattr(trie, 'pruned', False)
+
+        self.index = None
+        self.search = None
+
+        # vocabulary: ids are assigned in sorted word order
+        nodes = [trie.root]
+        vocab = set()
+        while nodes:
+            nodes = [child for node in nodes for child in node.children.values()]
+            vocab.update(node.word for node in nodes)
+        self.vocab = sorted(vocab)
+        self.ids = {word: i for i, word in enumerate(self.vocab)}
+
+        # root is the only element of order 0
+        self.words = [array('i', [-1])]
+        self.counts = [array('q', [trie.root.count])]
+        self.probs = [array('d', [0.0])]
+        self.bows = [array('d', [float('nan')])] if pruned else []
+        self.offsets = []
+
+        nodes = [trie.root]
+        while nodes:
+            words, counts, probs, bows, offsets = array('i'), array('q'), array('d'), array('d'), array('q', [0])
+            children = []
+            for node in nodes:
+                for word in sorted(node.children):
+                    child = node.children[word]
+                    words.append(self.ids[word])
+                    counts.append(child.count)
+                    probs.append(getattr(child, 'probability', 0.0))
+                    if pruned:
+                        bows.append(getattr(child, 'bow', float('nan')))
+                    children.append(child)
+                offsets.append(len(words))
+
+            if not children:
+                break
+
+            self.words.append(words)
+            self.counts.append(counts)
+            self.probs.append(probs)
+            if pruned:
+                self.bows.append(bows)
+            self.offsets.append(offsets)
+            nodes = children
+
+        # meta-information
+        self.size = getattr(trie, 'size', len(self.words) - 1)
+        for attr in ['backoff', 'smoothing', 'weights', 'pruned']:
+            if hasattr(trie, attr):
+                setattr(self, attr, getattr(trie, attr))
+        if hasattr(trie.oov, 'probability'):
+            self.oov.probability = trie.oov.probability
+
+    def build_sorted(self, ngrams, vocab, size):
+        """
+        build count arrays from a stream of lexicographically sorted (ngram, count) pairs of the same size
+        :param ngrams: iterable of sorted & unique (ngram tuple, count) pairs
+        :param vocab: vocabulary (words of all ngrams)
+        :param size: ngram size
+        """
+        from array import array
+
+        self.index = None
+        self.search = None
+
+        self.vocab = sorted(vocab)
+        self.ids = {word: i for i, word in enumerate(self.vocab)}
+        self.size = size
+
+        # root is the only element of order 0; sorted words give sorted ids within every parent
+        self.words = [array('i', [-1])] + [array('i') for _ in range(size)]
+        self.counts = [array('q', [0])] + [array('q') for _ in range(size)]
+        self.probs = [array('d', [0.0])] + [array('d') for _ in range(size)]
+        self.bows = []
+        self.offsets = [array('q', [0])] + [array('q') for _ in range(size - 1)]
+
+        prev = ()
+        for ngram, count in ngrams:
+            # first position the ngram differs from the previous one: new nodes from there on
+            d = 0
+            while d < len(prev) and ngram[d] == prev[d]:
+                d += 1
+
+            for k in range(d + 1, size + 1):
+                self.words[k].append(self.ids[ngram[k - 1]])
+                self.counts[k].append(0)
+                self.probs[k].append(0.0)
+                if k < size:
+                    self.offsets[k].append(len(self.words[k + 1]))
+
+            for k in range(size + 1):
+                self.counts[k][-1] += count
+            prev = ngram
+
+        # close children ranges of the last node of every order
+        for k in range(size):
+            self.offsets[k].append(len(self.words[k + 1]))
+
+    def write(self, model_file):
+        """
+        write trie arrays & meta-information in binary format:
+        magic, header length, json header, then 8-byte aligned arrays per order (words, counts, probs, bows,
+        search keys, offsets); search keys are stored so that memory-mapped models share them between processes
+        :param model_file: binary model file
+        """
+        import sys
+        import json
+        import struct
+
+        if self.search is None:
+            try:
+                self.keys()
+            except ImportError:
+                self.search = self.search_keys()
+
+        header = {
+            'byteorder': sys.byteorder,
+            'size': self.size,
+            'smoothing': getattr(self, 'smoothing', False),
+            'backoff': getattr(self, 'backoff', False),
+            'weights': getattr(self, 'weights', [0] * (self.size - 1) + [1]),
+            'oov': getattr(self.oov, 'probability', NgramModel.ZERO_LOG_PROB),
+            'vocab': self.vocab,
+            'bows': bool(self.bows),
+            'pruned': getattr(self, 'pruned', False),
+            'keys': True,
+            'orders': [len(words) for words in self.words]
+        }
+        header = json.dumps(header).encode('utf-8')
+
+        with open(model_file, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            for data in self.arrays():
+                f.write(b'\0' * (-f.tell() % 8))
+                f.write(data.tobytes())
+
+    def read(self, model_file, mmap=True):
+        """
+        read trie from binary format
+        :param model_file: binary model file
+        :param mmap: memory-map arrays (read-only, shared between processes) instead of copying into memory
+        """
+        import sys
+        import json
+        import struct
+        from array import array
+
+        self.index = None
+        self.search = None
+
+        with open(model_file, 'rb') as f:
+            if f.read(len(self.MAGIC)) != self.MAGIC:
+                raise ValueError("Unknown model format: {}".format(model_file))
+            length, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(length).decode('utf-8'))
+            start = f.tell()
+
+            if header['byteorder'] != sys.byteorder:
+                raise ValueError("Byte order mismatch: {} ({})".format(header['byteorder'], sys.byteorder))
+
+            if mmap:
+                import mmap as mm
+                self.buffer = memoryview(mm.mmap(f.fileno(), 0, access=mm.ACCESS_READ))
+            else:
+                f.seek(0)
+                self.buffer = memoryview(f.read())
+
+        # meta-information
+        self.size = header['size']
+        self.smoothing = header['smoothing']
+        self.backoff = header['backoff']
+        self.weights = header['weights']
+        self.oov.probability = header['oov']
+        self.pruned = header.get('pruned', False)
+        self.vocab = header['vocab']
+        self.ids = {word: i for i, word in enumerate(self.vocab)}
+
+        # arrays (models written without search keys compute them on first use)
+        self.words, self.counts, self.probs, self.bows, self.offsets = [], [], [], [], []
+        self.search = [None] if header.get('keys') else None
+        orders = header['orders']
+        pos = start
+        for k, n in enumerate(orders):
+            sections = [(self.words, 'i', n), (self.counts, 'q', n), (self.probs, 'd', n)]
+            if header.get('bows'):
+                sections.append((self.bows, 'd', n))
+            if header.get('keys') and k:
+                sections.append((self.search, 'q', n))
+            if k < len(orders) - 1:
+                sections.append((self.offsets, 'q', n + 1))
+            for target, typecode, length in sections:
+                pos += -pos % 8
+                view = self.buffer[pos:pos + length * array(typecode).itemsize].cast(typecode)
+                target.append(view if mmap else array(typecode, view))
+                pos += length * array(typecode).itemsize
+
+        if not mmap:
+            self.buffer = None
+
+    def read_arpa(self, arpa_file):
+        """
+        read ngram probabilities & back-off weights from ARPA format; entries of every order are bulk-loaded into
+        arrays when the order section ends (the model is scored with Katz back-off; counts are 0)
+        :param arpa_file: model in ARPA format
+        """
+        from math import log
+        from array import array
+
+        self.index = None
+        self.search = None
+
+        scale = log(10)  # ARPA log10 probabilities -> natural log
+
+        self.words = [array('i', [-1])]
+        self.counts = [array('q', [0])]
+        self.probs = [array('d', [0.0])]
+        self.bows = [array('d', [0.0])]
+        self.offsets = []
+
+        def value(field):
+            # ARPA log10 -99 is log 0
+            logprob = float(field)
+            return NgramModel.ZERO_LOG_PROB if logprob <= self.ARPA_ZERO else logprob * scale
+
+        def bow(fields):
+            # missing back-off weight is log 1
+            return value(fields[0]) if fields else 0.0
+
+        order = 0
+        entries = []
+        with open(arpa_file, 'r') as f:
+            for line in f:
+                if line.startswith('\\'):
+                    if order:
+                        self.extend(entries)
+                    line = line.strip()
+                    order = int(line[1:line.index('-')]) if line.endswith('-grams:') else 0
+                    entries = []
+                elif order:
+                    fields = line.split()
+                    if fields:
+                        entries.append((fields[1:order + 1], value(fields[0]), bow(fields[order + 1:])))
+            if order:
+                # no \end\ (e.g. truncated file): last order section ends at end of file
+                self.extend(entries)
+
+        # meta-information
+        self.size = len(self.words) - 1
+        self.smoothing = False
+        self.backoff = False
+        self.pruned = False
+        self.weights = [0] * (self.size - 1) + [1]
+        unk = self.get(['<unk>'])
+        self.oov.probability = unk.probability if unk.word is not None else NgramModel.ZERO_LOG_PROB
+
+    def extend(self, entries):
+        """
+        add next order from (ngram, log-prob, back-off weight) entries; prefixes of ngrams must be in the trie
+        :param entries: list of (ngram as list of words, log-prob, log back-off weight) tuples
+        """
+        from array import array
+
+        if len(self.words) == 1:
+            self.vocab = sorted(ngram[0] for ngram, p, bow in entries)
+            self.ids = {word: i for i, word in enumerate(self.vocab)}
+
+        # sort entries by parent index & word id (words missing from lower orders get new ids)
+        keys = []
+        for ngram, p, bow in entries:
+            parent = 0
+            for k, word in enumerate(ngram[:-1]):
+                parent = self.find(k, parent, word)
+                if parent < 0:
+                    raise ValueError("Missing prefix of ngram: {}".format(" ".join(ngram)))
+            if ngram[-1] not in self.ids:
+                self.ids[ngram[-1]] = len(self.vocab)
+                self.vocab.append(ngram[-1])
+            keys.append((parent, self.ids[ngram[-1]], p, bow))
+        keys.sort()
+
+        offsets = array('q', [0]) * (len(self.words[-1]) + 1)
+        for key in keys:
+            offsets[key[0] + 1] += 1
+        for i in range(1, len(offsets)):
+            offsets[i] += offsets[i - 1]
+
+        self.words.append(array('i', (wid for parent, wid, p, bow in keys)))
+        self.counts.append(array('q', [0]) * len(keys))
+        self.probs.append(array('d', (p for parent, wid, p, bow in keys)))
+        self.bows.append(array('d', (bow for parent, wid, p, bow in keys)))
+        self.offsets.append(offsets)
+
+    def write_arpa(self, arpa_file):
+        """
+        write ngram probabilities & back-off weights in ARPA format, order by order
+        (back-off weights of models not read from ARPA, pruned models too, are computed from probabilities, see
+        backoff_weights);
+        every vocabulary word has a unigram: words that only end ngrams get oov probability
+        :param arpa_file: ARPA file
+        """
+        from math import log
+
+        scale = log(10)  # natural log -> ARPA log10 probabilities
+        bows = self.bows if self.bows and not getattr(self, 'pruned', False) else self.backoff_weights()
+
+        def value(logprob):
+            # log 0 is ARPA log10 -99
+            return repr(self.ARPA_ZERO if logprob <= NgramModel.ZERO_LOG_PROB else logprob / scale)
+
+        unigrams = set(self.words[1]) if len(self.words) > 1 else set()
+        missing = [word for wid, word in enumerate(self.vocab) if wid not in unigrams]
+        oov = getattr(self.oov, 'probability', NgramModel.ZERO_LOG_PROB)
+
+        with open(arpa_file, 'w') as f:
+            f.write("\\data\\\n")
+            for k in range(1, len(self.words)):
+                f.write("ngram {}={}\n".format(k, len(self.words[k]) + (len(missing) if k == 1 else 0)))
+
+            prefixes = ['']  # ngram strings of the previous order
+            for k in range(1, len(self.words)):
+                f.write("\n\\{}-grams:\n".format(k))
+                ngrams = []
+                for i, prefix in enumerate(prefixes):
+                    lo, hi = self.span(k - 1, i)
+                    for j in range(lo, hi):
+                        ngram = prefix + self.vocab[self.words[k][j]]
+                        f.write(value(self.probs[k][j]) + "\t" + ngram)
+                        if k < len(self.words) - 1:
+                            f.write("\t" + value(bows[k][j]))
+                        f.write("\n")
+                        ngrams.append(ngram + " ")
+                if k == 1:
+                    for word in missing:
+                        f.write(value(oov) + "\t" + word + "\n")
+                prefixes = ngrams
+
+            f.write("\n\\end\\\n")
+
+    def katz(self, ngram, bows=None):
+        """
+        Katz back-off log probability: probability of the longest known suffix of the ngram
+        plus back-off weights of the contexts backed-off from (oov words get oov probability)
+        :param ngram: ngram as a list (or tuple) of tokens
+        :param bows: back-off weights per order (default model back-off weights)
+        :return: value
+        """
+        bows = self.bows if bows is None else bows
+        weight = 0.0
+        for k in range(len(ngram) - 1):
+            node = self.get(ngram[k:])
+            if node.word is not None:
+                return max(weight + node.probability, NgramModel.ZERO_LOG_PROB)
+            context = self.get(ngram[k:-1])
+            if context.word is not None:
+                weight += bows[context.order][context.index]
+        node = self.get(ngram[-1:])
+        if node.word is None:
+            return self.oov.probability
+        return max(weight + node.probability, NgramModel.ZERO_LOG_PROB)
+
+    def backoff_weights(self):
+        """
+        Katz back-off weights from probabilities: probability mass left by the seen continuations of a context,
+        normalized by the back-off probability mass of the same continuations
+        :return: list of back-off weight (log) arrays per order
+        """
+        from math import exp, log
+        from array import array
+
+        bows = [array('d', [0.0])]
+        contexts = [()]  # ngrams of the previous order
+        for k in range(1, len(self.words)):
+            ngrams = []
+            for i, context in enumerate(contexts):
+                lo, hi = self.span(k - 1, i)
+                ngrams.extend(context + (self.vocab[self.words[k][j]],) for j in range(lo, hi))
+            contexts = ngrams
+
+            bows.append(array('d', [0.0]) * len(ngrams))
+            for i, context in enumerate(ngrams):
+                lo, hi = self.span(k, i)
+                if lo == hi:
+                    continue
+                left = 1.0 - sum(exp(self.probs[k + 1][j]) for j in range(lo, hi))
+                lower = 1.0 - sum(exp(self.katz(context[1:] + (self.vocab[self.words[k + 1][j]],), bows=bows))
+                                  for j in range(lo, hi))
+                if left <= 1e-9:
+                    bows[k][i] = NgramModel.ZERO_LOG_PROB
+                elif lower > 1e-9:
+                    bows[k][i] = log(left / lower)
+        return bows
+
+    def arrays(self):
+        """
+        arrays in binary format order
+        :return: generator of arrays
+        """
+        for k in range(len(self.words)):
+            yield self.words[k]
+            yield self.counts[k]
+            yield self.probs[k]
+            if k < len(self.bows):
+                yield self.bows[k]
+            if self.search is not None and k:
+                yield self.search[k]
+            if k < len(self.offsets):
+                yield self.offsets[k]
+
+    @property
+    def root(self):
+        return ArrayNode(self, 0, 0)
+
+    def span(self, order, index):
+        """
+        range of children indices (in order + 1) of a node
+        :param order: node order
+        :param index: node index
+        :return: tuple (lo, hi)
+        """
+        if order >= len(self.offsets):
+            return 0, 0
+        return self.offsets[order][index], self.offsets[order][index + 1]
+
+    def find(self, order, index, word):
+        """
+        binary search for a child of a node
+        :param order: node order
+        :param index: node index
+        :param word: child word
+        :return: child index in order + 1; -1 if not found
+        """
+        from bisect import bisect_left
+        wid = self.ids.get(word)
+        if wid is None:
+            return -1
+        lo, hi = self.span(order, index)
+        i = bisect_left(self.words[order + 1], wid, lo, hi)
+        return i if i < hi and self.words[order + 1][i] == wid else -1
+
+    def get(self, sequence):
+        order, index = 0, 0
+        for word in sequence:
+            index = self.find(order, index, word)
+            if index < 0:
+                return self.oov
+            order += 1
+        return ArrayNode(self, order, index)
+
+    def keys(self):
+        """
+        search keys of every order (numpy): node j of order k is parent * |vocab| + word id,
+        keys are ascending as children are sorted by parent & word id
+        :return: list of key arrays per order (None for the root)
+        """
+        import numpy as np
+        if self.search is None:
+            v = len(self.vocab)
+            self.search = [None]
+            for k in range(1, len(self.words)):
+                offsets = np.frombuffer(self.offsets[k - 1], dtype=np.int64)
+                parents = np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+                self.search.append(parents * v + np.frombuffer(self.words[k], dtype=np.int32))
+        elif len(self.search) > 1 and not isinstance(self.search[1], np.ndarray):
+            # keys read from binary format: arrays are wrapped without copying (memory-mapped pages stay shared)
+            self.search = [None] + [np.frombuffer(keys, dtype=np.int64) for keys in self.search[1:]]
+        return self.search
+
+    def search_keys(self):
+        """
+        search keys of every order without numpy (see keys)
+        :return: list of key arrays per order (None for the root)
+        """
+        from array import array
+        v = len(self.vocab)
+        search = [None]
+        for k in range(1, len(self.words)):
+            offsets, words, keys = self.offsets[k - 1], self.words[k], array('q')
+            for parent in range(len(offsets) - 1):
+                keys.extend(parent * v + words[i] for i in range(offsets[parent], offsets[parent + 1]))
+            search.append(keys)
+        return search
+
+    def lookup(self, grams):
+        """
+        bulk lookup of ngrams of the same size (numpy): nodes of every order are searched at once
+        :param grams: 2-D array of word ids (one ngram per row; -1 for unknown words)
+        :return: tuple of prefix log-probs (rows x size; oov probability for prefixes not in trie),
+            node indices (in order size), mask of ngrams in trie & mask of last words in trie
+        """
+        import numpy as np
+        keys = self.keys()
+        v = len(self.vocab)
+        rows, size = grams.shape
+        probs = np.full((rows, size), getattr(self.oov, 'probability', NgramModel.ZERO_LOG_PROB), dtype=np.float64)
+        found = np.ones(rows, dtype=bool)
+        node = np.zeros(rows, dtype=np.int64)
+        for k in range(1, size + 1):
+            if k >= len(keys) or not len(keys[k]):
+                found[:] = False
+                break
+            query = node * v + grams[:, k - 1]
+            pos = np.minimum(np.searchsorted(keys[k], query), len(keys[k]) - 1)
+            found &= (grams[:, k - 1] >= 0) & (keys[k][pos] == query)
+            node = np.where(found, pos, 0)
+            probs[found, k - 1] = np.frombuffer(self.probs[k], dtype=np.float64)[pos[found]]
+
+        known = np.zeros(rows, dtype=bool)
+        if len(keys) > 1 and len(keys[1]):
+            pos = np.minimum(np.searchsorted(keys[1], grams[:, -1]), len(keys[1]) - 1)
+            known = (grams[:, -1] >= 0) & (keys[1][pos] == grams[:, -1])
+        return probs, node, found, known
+
+    def katz_bulk(self, grams):
+        """
+        Katz back-off log probabilities of ngrams of the same size (numpy, see katz): suffixes & contexts
+        of all ngrams are searched at once, order by order
+        :param grams: 2-D array of word ids (one ngram per row; -1 for unknown words)
+        :return: array of values
+        """
+        import numpy as np
+        rows, size = grams.shape
+        weight = np.zeros(rows, dtype=np.float64)
+        scores = np.full(rows, getattr(self.oov, 'probability', NgramModel.ZERO_LOG_PROB), dtype=np.float64)
+        done = np.zeros(rows, dtype=bool)
+        for k in range(size):
+            probs, _, found, _ = self.lookup(grams[:, k:])
+            found &= ~done
+            scores[found] = np.maximum(weight[found] + probs[found, -1], NgramModel.ZERO_LOG_PROB)
+            done |= found
+            if k < size - 1:
+                _, node, found, _ = self.lookup(grams[:, k:-1])
+                found &= ~done
+                weight[found] += np.frombuffer(self.bows[size - 1 - k], dtype=np.float64)[node[found]]
+        return scores
+
+    def traverse(self, size=None):
+        sequence = []
+        stack = [(0, 0)]
+        while stack:
+            order, index = stack.pop()
+            if order:
+                del sequence[order - 1:]
+                sequence.append(self.vocab[self.words[order][index]])
+
+            lo, hi = self.span(order, index)
+            if lo == hi:
+                yield list(sequence)
+
+            if size:
+                if order == size:
+                    yield list(sequence)
+
+            stack.extend((order + 1, i) for i in range(hi - 1, lo - 1, -1))
+
+    def statistics(self):
+        """
+        compute order statistics from arrays
+        :return: dict of number of leaves & count-of-counts per order
+        """
+        from collections import Counter
+        leaves = len(self.words[-1]) if len(self.words) > 1 else 1
+        for offsets in self.offsets:
+            leaves += sum(1 for i in range(len(offsets) - 1) if offsets[i] == offsets[i + 1])
+        return {'leaves': leaves, 'count_of_counts': [{}] + [dict(Counter(counts)) for counts in self.counts[1:]]}
+
+    @property
+    def distinct(self):
+        return [len(words) for words in self.words]
+
+    @property
+    def leaves(self):
+        self.index = self.index if self.index else self.statistics()
+        return self.index['leaves']
+
+    @property
+    def count_of_counts(self):
+        self.index = self.index if self.index else self.statistics()
+        return self.index['count_of_counts']
 
     def v(self, size=None):
-        return len(list(self.traverse(size=size)))
+        # number of leaves & nodes of order size: len(list(self.traverse(size=size)))
+        return self.leaves + (len(self.words[size]) if size and size < len(self.words) else 0)
+
+    def walk(self):
+        """
+        depth-first (pre-order) walk over trie nodes
+        :return: generator of (depth, node, is leaf) tuples
+        """
+        stack = [(0, 0)]
+        while stack:
+            order, index = stack.pop()
+            lo, hi = self.span(order, index)
+            yield order, ArrayNode(self, order, index), lo == hi
+            stack.extend((order + 1, i) for i in range(hi - 1, lo - 1, -1))
+
+    def nbytes(self):
+        """
+        estimated memory footprint: arrays (memory-mapped ones included) & vocabulary
+        :return: bytes
+        """
+        from sys import getsizeof
+        return (sum(memoryview(data).nbytes for data in self.arrays()) +
+                getsizeof(self.vocab) + getsizeof(self.ids) + sum(getsizeof(word) for word in self.vocab))
+
+
+class Stats(object):
+    """
+    model instrumentation: per-phase timers (accumulated seconds), ngram lookup counters & model size report;
+    callbacks are called as callback(phase, seconds) at the end of every phase
+    """
+
+    def __init__(self, callbacks=None):
+        self.timers = OrderedDict()  # phase -> seconds
+        self.lookups = 0             # ngram lookups (logprob & advance)
+        self.hits = 0                # ngrams found in model
+        self.oov = 0                 # ngrams ending with a word without unigram in model (backed-off to oov)
+        self.callbacks = list(callbacks) if callbacks else []
+
+    def __set__(self, instance, value):
+        self.instance = value
+
+    def __get__(self, instance, owner):
+        return self.instance
+
+    def reset(self):
+        self.timers = OrderedDict()
+        self.lookups = 0
+        self.hits = 0
+        self.oov = 0
+
+    @contextmanager
+    def timer(self, phase):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            self.timers[phase] = self.timers.get(phase, 0.0) + seconds
+            for callback in self.callbacks:
+                callback(phase, seconds)
+
+    def report(self, model=None):
+        """
+        stats as a dict; with a model also ngrams per order, number of nodes & estimated memory footprint
+        :param model: model trie (Trie or ArrayTrie)
+        :return: dict
+        """
+        stats = {'timers': dict(self.timers), 'lookups': self.lookups, 'hits': self.hits,
+                 'misses': self.lookups - self.hits, 'oov': self.oov}
+        if model is not None:
+            stats['ngrams'] = list(model.distinct[1:])
+            stats['nodes'] = sum(model.distinct)
+            stats['memory'] = model.nbytes()
+        return stats
+
+
+class State(object):
+
+    def __init__(self, context, node=None):
+        self.context = context  # last (up to n-1) tokens as a tuple
+        self.node = node        # context node in model trie (None for contexts shorter than n-1)
+
+    def __set__(self, instance, value):
+        self.instance = value
+
+    def __get__(self, instance, owner):
+        return self.instance
 
 
 class NgramModel(object):
 
     ZERO_LOG_PROB = -1000
+    STATE_CACHE_SIZE = 100000  # max number of context states kept (least recently used are dropped)
 
-    def __init__(self, corpus=None, n=2, smoothing=False, backoff=False):
+    def __init__(self, corpus=None, n=2, smoothing=False, backoff=False, compact=False, workers=1,
+                 memory=None, tmpdir=None, callbacks=None, weights=None):
         self.model = None
-        if corpus:
-            self.make(corpus, n=n, smoothing=smoothing, backoff=backoff)
+        self.tables = {}  # sampling tables cache (context -> continuations)
+        self.states = OrderedDict()  # context states cache (context -> State)
+        self.stats = Stats(callbacks=callbacks)  # timers & lookup counters
+        if corpus is not None:
+            self.make(corpus, n=n, smoothing=smoothing, backoff=backoff, compact=compact, workers=workers,
+                      memory=memory, tmpdir=tmpdir, weights=weights)
 
     def __set__(self, instance, value):
         self.instance = value
@@ -74,6 +941,49 @@ class NgramModel(object):
     def __get__(self, instance, owner):
         return self.instance
 
+    def save(self, model_file):
+        """
+        save model in binary format (model is stored as ArrayTrie)
+        :param model_file: binary model file
+        """
+        model = self.model if isinstance(self.model, ArrayTrie) else ArrayTrie(self.model)
+        model.write(model_file)
+
+    def load(self, model_file, mmap=True):
+        """
+        load model from binary format
+        :param model_file: binary model file
+        :param mmap: memory-map model arrays; read-only pages are shared by forked processes
+        """
+        self.stats.reset()
+        with self.stats.timer('load'):
+            model = ArrayTrie()
+            model.read(model_file, mmap=mmap)
+        self.model = model
+        self.tables = {}
+        self.states = OrderedDict()
+
+    def read_arpa(self, arpa_file):
+        """
+        read model from ARPA format (model is stored as ArrayTrie)
+        :param arpa_file: model in ARPA format
+        """
+        self.stats.reset()
+        with self.stats.timer('load'):
+            model = ArrayTrie()
+            model.read_arpa(arpa_file)
+        self.model = model
+        self.tables = {}
+        self.states = OrderedDict()
+
+    def write_arpa(self, arpa_file):
+        """
+        write model in ARPA format
+        :param arpa_file: ARPA file
+        """
+        model = self.model if isinstance(self.model, ArrayTrie) else ArrayTrie(self.model)
+        model.write_arpa(arpa_file)
+
     @staticmethod
     def ngrams(sequence, n=2):
         """
@@ -84,121 +994,793 @@ class NgramModel(object):
         """
         return [sequence[i:i + n] for i in range(len(sequence) - n + 1)]
 
-    def count(self, corpus, n=2):
+    def count(self, corpus, n=2, weights=None):
         """
-        count ngrams in a corpus and stores in a Trie
+        count ngrams in a corpus and stores in a Trie (see count_parallel for counting in worker processes)
         :param corpus: list-of-lists
         :param n: ngram size to count
-        :return:
+        :param weights: sentence occurrence counts (deduplicated corpus)
+        :return: Trie of counts
         """
         counts = Trie()
-        for sequence in corpus:
+        for sequence, weight in zip(corpus, weights) if weights else ((s, 1) for s in corpus):
             for ngram in self.ngrams(sequence, n=n):
-                counts.add(ngram)
+                counts.add(ngram, count=weight)
         return counts
 
-    def make(self, corpus, n=2, smoothing=False, backoff=False):
+    @staticmethod
+    def count_parallel(corpus, n=2, workers=2, weights=None):
+        """
+        count ngrams in worker processes: ngrams are partitioned by their first word into ranges of the sorted
+        vocabulary (balanced by word frequency), so every worker counts & builds the arrays of disjoint subtrees;
+        partition arrays are concatenated into an ArrayTrie (no per-ngram work in the parent process)
+        :param corpus: list-of-lists
+        :param n: ngram size to count
+        :param workers: number of processes
+        :param weights: sentence occurrence counts (deduplicated corpus)
+        :return: ArrayTrie of counts
+        """
+        from array import array
+        from collections import Counter
+        from multiprocessing import Pool
+
+        corpus = corpus if isinstance(corpus, list) else list(corpus)
+
+        frequencies = Counter()
+        for sequence in corpus:
+            frequencies.update(sequence)
+        vocab = sorted(frequencies)
+
+        # partition upper bounds (inclusive): vocabulary ranges of about equal word frequency
+        bounds = []
+        step = sum(frequencies.values()) / workers
+        total = 0
+        for word in vocab:
+            total += frequencies[word]
+            if total >= step * (len(bounds) + 1) and len(bounds) < workers - 1:
+                bounds.append(word)
+        ranges = list(zip([None] + bounds, bounds + [None]))
+
+        with Pool(workers, initializer=count_init, initargs=(corpus, weights, vocab, n)) as pool:
+            partitions = pool.map(count_range, ranges)
+
+        trie = ArrayTrie()
+        trie.vocab = vocab
+        trie.ids = {word: i for i, word in enumerate(vocab)}
+        trie.size = n
+        trie.words = [array('i', [-1])] + [array('i') for _ in range(n)]
+        trie.counts = [array('q', [0])] + [array('q') for _ in range(n)]
+        trie.offsets = [array('q', [0]) for _ in range(n)]
+        for words, counts, offsets in partitions:
+            trie.counts[0][0] += counts[0][0]
+            for k in range(1, n + 1):
+                if k < n:
+                    base = len(trie.words[k + 1])
+                    trie.offsets[k].extend(array('q', (offset + base for offset in offsets[k][1:])))
+                trie.words[k].extend(words[k])
+                trie.counts[k].extend(counts[k])
+        trie.offsets[0].append(len(trie.words[1]))
+        trie.probs = [array('d', [0.0]) * len(words) for words in trie.words]
+        return trie
+
+    @staticmethod
+    def count_external(corpus, n=2, memory=1000000, tmpdir=None, weights=None):
+        """
+        count ngrams with bounded memory: partial counts are spilled to temporary files as sorted runs
+        whenever the number of distinct ngrams in memory reaches the budget, runs are k-way merged
+        into an ArrayTrie (corpus is read in a single pass, so it can be a stream)
+        :param corpus: iterable of lists
+        :param n: ngram size to count
+        :param memory: memory budget as number of distinct ngrams kept in memory
+        :param tmpdir: directory for temporary files
+        :param weights: sentence occurrence counts (deduplicated corpus)
+        :return: ArrayTrie of counts
+        """
+        import os
+        import heapq
+        import marshal
+        import tempfile
+        from collections import Counter
+
+        # runs are sequences of marshalled (ngram, count) records: tokens may contain any character
+        def spill(counts):
+            with tempfile.NamedTemporaryFile('wb', dir=tmpdir, suffix='.counts', delete=False) as f:
+                for record in sorted(counts.items()):
+                    marshal.dump(record, f)
+            return f.name
+
+        def run(run_file):
+            with open(run_file, 'rb') as f:
+                while True:
+                    try:
+                        yield marshal.load(f)
+                    except EOFError:
+                        break
+
+        def merge(runs):
+            prev, total = None, 0
+            for ngram, count in heapq.merge(*runs):
+                if ngram != prev and prev is not None:
+                    yield prev, total
+                    total = 0
+                prev = ngram
+                total += count
+            if prev is not None:
+                yield prev, total
+
+        vocab = set()
+        runs = []
+        counts = Counter()
+        try:
+            for sequence, weight in zip(corpus, weights) if weights else ((s, 1) for s in corpus):
+                vocab.update(sequence)
+                for ngram in NgramModel.ngrams(sequence, n=n):
+                    counts[tuple(ngram)] += weight
+                if len(counts) >= memory:
+                    runs.append(spill(counts))
+                    counts = Counter()
+
+            trie = ArrayTrie()
+            trie.build_sorted(merge([run(f) for f in runs] + [iter(sorted(counts.items()))]), vocab, n)
+        finally:
+            for run_file in runs:
+                os.remove(run_file)
+        return trie
+
+    def make(self, corpus, n=2, smoothing=False, backoff=False, compact=False, workers=1,
+             memory=None, tmpdir=None, weights=None):
         """
         compute ngram probabilities from frequency counts
         :param corpus: corpus to build ngram model for
         :param n: ngram size
         :param smoothing: additive smoothing on/ogg (only +1)
         :param backoff: deleted interpolation on/off (simplest form of back-off)
+        :param compact: store model as ArrayTrie (integer ids & arrays) instead of Trie
+        :param workers: number of processes for ngram counting; requires compact, as parallel counts are
+            an ArrayTrie (building Trie nodes from them in this process is slower than counting serially)
+        :param memory: count with bounded memory (max distinct ngrams in memory); model is an ArrayTrie
+        :param tmpdir: directory for temporary count files (with memory)
+        :param weights: sentence occurrence counts (default weights of a deduplicated Corpus)
         :return: trie
         """
-        from math import log
+        if workers > 1 and not memory and not compact:
+            raise ValueError("Parallel counting requires a compact model (compact=True)")
+
+        self.stats.reset()
+        weights = weights if weights is not None else getattr(corpus, 'weights', None)
 
         # get ngram counts
-        counts = self.count(corpus, n=n)
+        with self.stats.timer('count'):
+            if memory:
+                counts = self.count_external(corpus, n=n, memory=memory, tmpdir=tmpdir, weights=weights)
+            elif workers > 1:
+                counts = self.count_parallel(corpus, n=n, workers=workers, weights=weights)
+            else:
+                counts = self.count(corpus, n=n, weights=weights)
 
         # set meta-information
         counts.size = n               # meta-info: ngram-size
         counts.backoff = backoff      # meta-info: back-off  true|false
         counts.smoothing = smoothing  # meta-info: smoothing true|false
 
-        # smoothing
-        a, v = self.additive_smoothing(counts) if smoothing else (0, 0)
-        # back-off weights
-        counts.weights = self.deleted_interpolation(counts) if backoff else [0] * (n-1) + [1]
-
-        # update oov probability:
-        counts.oov.probability = log(a/v) if smoothing else self.ZERO_LOG_PROB
-
-        # compute probabilities from counts for every ngram <= n
-        for ngram in counts.traverse():
-            for i in range(len(ngram)):
-                n = counts.get(ngram[0:i+1])  # get ngram node
-                p = counts.get(ngram[0:i])    # get parent node
-                n.probability = log((n.count + a)/(p.count + v))
+        self.fit(counts)
 
+        if compact and isinstance(counts, Trie):
+            with self.stats.timer('compact'):
+                counts = ArrayTrie(counts)
         self.model = counts
+        self.tables = {}
+        self.states = OrderedDict()
 
-    @staticmethod
-    def additive_smoothing(counts, a=1):
+    def fit(self, counts):
         """
-        additive smoothing (laplace)
-        :param counts: counts trie
-        :param a: alpha to add; a = 1 --> +1 smoothing
-        :return:
+        compute probabilities & back-off weights of a counts trie according to its meta-information
+        :param counts: counts trie (with size, smoothing & backoff set)
         """
-        return a, (counts.v(size=counts.size - 1) * a)
+        from math import log
 
-    @staticmethod
-    def deleted_interpolation(counts):
+        # smoothing
+        with self.stats.timer('smoothing'):
+            a, v = self.additive_smoothing(counts) if counts.smoothing else (0, 0)
+
+        # update oov probability:
+        counts.oov.probability = log(a/v) if counts.smoothing else self.ZERO_LOG_PROB
+
+        # compute probabilities from counts for every ngram <= n & back-off weights in a single pass
+        with self.stats.timer('estimate'):
+            weights = self.estimate(counts, a=a, v=v, interpolation=counts.backoff)
+        counts.weights = weights if counts.backoff else [0] * (counts.size-1) + [1]
+
+    def update(self, corpus, weights=None):
         """
-        deleted interpolation
-        :param counts: counts trie
-        :return: interpolation weights for ngram models
+        add ngram counts of new sentences to the model & recompute probabilities of the affected contexts only
+        (contexts on the paths of new ngrams); a change of the smoothing term requires a full re-estimation;
+        deleted interpolation weights are recomputed from counts in a pass over the leaves, as every leaf vote
+        depends on the total count (see estimate); back-off weights of pruned contexts are recomputed too, as their
+        lower-order probabilities change (see renormalize)
+        :param corpus: list-of-lists
+        :param weights: sentence occurrence counts (default weights of a deduplicated Corpus)
         """
-        w = [0] * counts.size
-        for ngram in counts.traverse():
-            # current ngram count
-            v = counts.get(ngram).count
-            # (n)-gram counts
-            n = [counts.get(ngram[0:i+1]).count for i in range(len(ngram))]
-            # (n-1)-gram counts -- parent node
-            p = [counts.get(ngram[0:i]).count for i in range(len(ngram))]
-            # - 1 from both counts & normalize
-            d = [float((n[i]-1)/(p[i]-1)) if (p[i]-1 > 0) else 0.0 for i in range(len(n))]
-            # increment weight of the max by raw ngram count
-            k = d.index(max(d))
-            w[k] += v
-        return [float(v)/sum(w) for v in w]
+        from math import log
+        counts = self.model
+        weights = weights if weights is not None else getattr(corpus, 'weights', None)
+        if not isinstance(counts, Trie):
+            raise ValueError("Updating requires a Trie model (update before compacting)")
 
-    def score(self, sequence):
-        """
+        smoothing = self.additive_smoothing(counts) if counts.smoothing else (0, 0)
+
+        contexts = {}  # nodes with updated counts that have children: id -> node
+        with self.stats.timer('count'):
+            for sequence, weight in zip(corpus, weights) if weights else ((s, 1) for s in corpus):
+                for ngram in self.ngrams(sequence, n=counts.size):
+                    counts.add(ngram, count=weight)
+                    node = counts.root
+                    contexts[id(node)] = node
+                    for word in ngram[:-1]:
+                        node = node.children[word]
+                        contexts[id(node)] = node
+
+        a, v = self.additive_smoothing(counts) if counts.smoothing else (0, 0)
+        if (a, v) != smoothing:
+            self.fit(counts)
+        else:
+            with self.stats.timer('estimate'):
+                for node in contexts.values():
+                    for child in node.children.values():
+                        child.probability = log((child.count + a)/(node.count + v))
+                if counts.backoff:
+                    counts.weights = self.estimate(counts, probability=False, interpolation=True)
+        if getattr(counts, 'pruned', False):
+            self.renormalize()
+
+        self.tables = {}
+        self.states = OrderedDict()
+
+    def prune(self, min_count=None, threshold=None, target=None):
+        """
+        prune highest-order ngrams & re-estimate probabilities and back-off weights of the pruned model:
+        contexts of pruned ngrams keep the mass of their pruned continuations as a back-off weight (see renormalize);
+        ngram relative entropy is P(ngram) * (log p(ngram) - log p'(ngram)), where p' is the back-off probability
+        of the ngram if it is pruned (compacting or saving a pruned model keeps back-off weights in ArrayTrie.bows)
+
+        :param min_count: prune ngrams with count below min_count
+        :param threshold: prune ngrams with relative entropy below threshold
+        :param target: prune ngrams (lowest relative entropy first) until model has at most target ngrams
+        :return: number of pruned ngrams
+        """
+        counts = self.model
+        if not isinstance(counts, Trie):
+            raise ValueError("Pruning requires a Trie model (prune before compacting)")
+
+        if counts.size < 2:
+            return 0
+
+        with self.stats.timer('prune'):
+            pruned = self.select(min_count=min_count, threshold=threshold, target=target)
+            for ngram in pruned:
+                counts.rm(ngram)
+                counts.get(ngram[:-1]).bow = 0.0  # context of pruned ngrams (weight is set by renormalize)
+            if pruned:
+                counts.pruned = True  # meta-info: model has back-off weights of pruned contexts
+
+        # back-off weights of all pruned contexts: interpolation weights of lower orders are re-estimated too
+        self.fit(counts)
+        with self.stats.timer('prune'):
+            self.renormalize()
+        self.tables = {}
+        self.states = OrderedDict()
+        return len(pruned)
+
+    def select(self, min_count=None, threshold=None, target=None):
+        """
+        select highest-order ngrams to prune (see prune)
+        :param min_count: prune ngrams with count below min_count
+        :param threshold: prune ngrams with relative entropy below threshold
+        :param target: prune ngrams (lowest relative entropy first) until model has at most target ngrams
+        :return: set of ngram tuples
+        """
+        from math import exp
+        counts = self.model
+
+        # highest-order ngrams with counts & relative entropy
+        candidates = []
+        path = []  # words on the path from root to the current node
+        for depth, node, leaf in counts.walk():
+            del path[depth:]
+            path.append(node.word)
+            if depth != counts.size - 1 or leaf:
+                continue
+
+            # left-over & lower-order mass of the context
+            context = tuple(path[1:])
+            lower = {word: self.lower(context[1:] + (word,)) for word in node.children}
+            left = 1.0 - sum(exp(child.probability) for child in node.children.values())
+            left_lower = 1.0 - sum(exp(p) for p in lower.values())
+            for word, child in node.children.items():
+                # back-off probability if only this ngram is pruned: its mass moves to the back-off weight
+                bow = self.backoff_weight(left + exp(child.probability), left_lower + exp(lower[word]))
+                q = max(bow + lower[word], self.ZERO_LOG_PROB)
+                candidates.append((context + (word,), child.count,
+                                   child.count / counts.root.count * (child.probability - q)))
+
+        pruned = set()
+        if min_count:
+            pruned.update(ngram for ngram, count, entropy in candidates if count < min_count)
+
+        if threshold is not None:
+            pruned.update(ngram for ngram, count, entropy in candidates if entropy < threshold)
+
+        if target is not None:
+            excess = sum(1 for _ in counts.walk()) - 1 - len(pruned) - target
+            for ngram, count, entropy in sorted(candidates, key=lambda c: c[2]):
+                if excess <= 0:
+                    break
+                if ngram not in pruned:
+                    pruned.add(ngram)
+                    excess -= 1
+        return pruned
+
+    def renormalize(self, contexts=None):
+        """
+        set back-off weights of contexts (of pruned ngrams): probability mass left by the remaining continuations,
+        normalized by the lower-order mass of the same continuations (as Katz back-off weights, see
+        ArrayTrie.backoff_weights); ngrams missing from these contexts are scored as weight + lower-order probability
+        :param contexts: list of (context tuple, node) pairs (default every context with a back-off weight)
+        """
+        from math import exp
+        if contexts is None:
+            contexts = []
+            path = []
+            for depth, node, leaf in self.model.walk():
+                del path[depth:]
+                path.append(node.word)
+                if hasattr(node, 'bow'):
+                    contexts.append((tuple(path[1:]), node))
+
+        for context, node in contexts:
+            left = 1.0 - sum(exp(child.probability) for child in node.children.values())
+            lower = 1.0 - sum(exp(self.lower(context[1:] + (word,))) for word in node.children)
+            node.bow = self.backoff_weight(left, lower)
+
+    @staticmethod
+    def backoff_weight(left, lower):
+        """
+        back-off weight of a context (see ArrayTrie.backoff_weights)
+        :param left: probability mass left by the continuations of the context
+        :param lower: lower-order (back-off) probability mass left by the same continuations
+        :return: log weight
+        """
+        from math import log
+        if left <= 1e-9:
+            return NgramModel.ZERO_LOG_PROB
+        return log(left / lower) if lower > 1e-9 else 0.0
+
+    @staticmethod
+    def additive_smoothing(counts, a=1):
+        """
+        additive smoothing (laplace)
+        :param counts: counts trie
+        :param a: alpha to add; a = 1 --> +1 smoothing
+        :return:
+        """
+        return a, (counts.v(size=counts.size - 1) * a)
+
+    @staticmethod
+    def deleted_interpolation(counts):
+        """
+        deleted interpolation
+        :param counts: counts trie
+        :return: interpolation weights for ngram models
+        """
+        return NgramModel.estimate(counts, probability=False, interpolation=True)
+
+    @staticmethod
+    def estimate(counts, a=0, v=0, probability=True, interpolation=False):
+        """
+        compute ngram probabilities & deleted interpolation weights in a single depth-first pass;
+        each node probability is computed once from its parent count carried along the path
+        :param counts: counts trie
+        :param a: additive smoothing alpha
+        :param v: additive smoothing denominator term
+        :param probability: if to set node probabilities
+        :param interpolation: if to compute deleted interpolation weights
+        :return: interpolation weights for ngram models (None if interpolation is off)
+        """
+        from math import log
+
+        w = [0] * counts.size
+        path = []  # counts of nodes on the path from root to the current node
+        for depth, node, leaf in counts.walk():
+            del path[depth:]
+            path.append(node.count)
+
+            if not depth:
+                continue
+
+            if probability:
+                node.probability = log((node.count + a)/(path[-2] + v))
+
+            if interpolation and leaf:
+                # increment weight of the max by raw ngram count
+                w[NgramModel.vote(path)] += node.count
+
+        if not interpolation:
+            return None
+
+        return NgramModel.normalize(w)
+
+    @staticmethod
+    def vote(path):
+        """
+        deleted interpolation vote of a leaf
+        :param path: counts of nodes on the path from root to the leaf
+        :return: index of the order with the max ratio of (n)-gram & (n-1)-gram counts
+        """
+        # - 1 from both (n)-gram & (n-1)-gram counts & normalize
+        d = [float((path[i+1]-1)/(path[i]-1)) if (path[i]-1 > 0) else 0.0 for i in range(len(path) - 1)]
+        return d.index(max(d))
+
+    @staticmethod
+    def normalize(w):
+        """
+        normalize raw deleted interpolation weights
+        :param w: raw weights (sums of leaf votes)
+        :return: interpolation weights
+        """
+        total = sum(w)
+        if not total:
+            # no ngrams (empty corpus): highest order only
+            return [0.0] * (len(w) - 1) + [1.0]
+        return [float(v)/total for v in w]
+
+    def logprob(self, ngram):
+        """
+        log probability of an ngram (with back-off computation for oov ngrams)
+        :param ngram: ngram as a list (or tuple) of tokens
+        :return: value
+        """
+        n = self.model.get(ngram)
+
+        self.stats.lookups += 1
+        if n.word is not None:
+            self.stats.hits += 1
+        elif self.model.get(ngram[-1:]).word is None:
+            self.stats.oov += 1
+
+        # oov node check & back-off computation
+        return n.probability if n.word is not None else self.backoff(ngram)
+
+    def lower(self, ngram):
+        """
+        log probability of an ngram (see logprob) without lookup counters, e.g. of lower-order ngrams
+        :param ngram: ngram as a list (or tuple) of tokens
+        :return: value
+        """
+        n = self.model.get(ngram)
+        return n.probability if n.word is not None else self.backoff(ngram)
+
+    def backoff(self, ngram):
+        """
+        back-off log probability of an ngram that is not in the model: Katz back-off for ARPA models,
+        back-off weight of the context & lower-order probability for contexts of pruned ngrams,
+        deleted interpolation with back-off, otherwise oov probability
+        :param ngram: ngram as a list (or tuple) of tokens
+        :return: value
+        """
+        if getattr(self.model, 'bows', None) and not getattr(self.model, 'pruned', False):
+            return self.model.katz(ngram)
+
+        context = self.model.get(ngram[:-1]) if len(ngram) > 1 else self.model.oov
+        if context.word is not None and hasattr(context, 'bow'):
+            return max(context.bow + self.lower(ngram[1:]), self.ZERO_LOG_PROB)
+
+        if self.model.backoff:
+            return sum([self.model.get(ngram[0:i + 1]).probability * self.model.weights[i] for i in range(len(ngram))])
+        return self.model.oov.probability
+
+    def score(self, sequence):
+        """
         score a sequence using ngram model
         :param sequence: sentence as a list of tokens
         :return: value
         """
-        probs = []
-        for ngram in self.ngrams(sequence, self.model.size):
-            n = self.model.get(ngram)
-            p = n.probability
+        probs = [self.logprob(ngram) for ngram in self.ngrams(sequence, self.model.size)]
+        return float(sum(probs))
 
-            # oov node check & back-off computation
-            if n.word is None and self.model.backoff:
-                p = sum([self.model.get(ngram[0:i + 1]).probability * self.model.weights[i] for i in range(len(ngram))])
+    def state(self, context):
+        """
+        get (cached) state of a context
+        :param context: context as a tuple of (up to n-1) tokens
+        :return: State
+        """
+        state = self.states.get(context)
+        if state is None:
+            node = self.model.get(context) if len(context) == self.model.size - 1 else None
+            state = self.states[context] = State(context, node)
+            if len(self.states) > self.STATE_CACHE_SIZE:
+                self.states.popitem(last=False)
+        else:
+            self.states.move_to_end(context)
+        return state
 
-            probs.append(p)
-        return float(sum(probs))
+    def initial_state(self, history=None, bos='<s>'):
+        """
+        get state to start incremental scoring from
+        :param history: tokens preceding the first token to score; default n-1 bos tags
+        :param bos: beginning-of-sentence tag
+        :return: State
+        """
+        history = tuple([bos] * (self.model.size - 1) if history is None else history)
+        return self.state(history[max(len(history) - (self.model.size - 1), 0):])
 
-    def generate(self, bos='<s>', eos='</s>'):
+    def advance(self, state, token):
+        """
+        score next token given a state (incremental version of score)
+        :param state: State of the history
+        :param token: next token
+        :return: tuple of new State & log probability of the token (0.0 while history is shorter than n-1)
         """
-        generate a random sequence from ngram model
+        context = state.context + (token,)
+        if len(context) < self.model.size:
+            return self.state(context), 0.0
+
+        node = state.node.child(token)
+        if node is None:
+            return self.state(context[1:]), self.logprob(context)
+
+        self.stats.lookups += 1
+        self.stats.hits += 1
+        return self.state(context[1:]), node.probability
+
+    def rescore(self, hypotheses, history=()):
+        """
+        score n-best hypotheses: hypotheses are arranged in a prefix tree & every shared prefix is scored once
+        (incrementally, from the state of its parent prefix)
+        :param hypotheses: list of hypotheses as lists of tokens
+        :param history: tokens preceding every hypothesis (not scored)
+        :return: list of scores (in hypotheses order)
+        """
+        # prefix tree as nested dicts; None key holds indices of hypotheses ending at the node
+        tree = {}
+        for i, hyp in enumerate(hypotheses):
+            node = tree
+            for token in hyp:
+                node = node.setdefault(token, {})
+            node.setdefault(None, []).append(i)
+
+        scores = [0.0] * len(hypotheses)
+        stack = [(tree, self.initial_state(history=history), 0)]
+        while stack:
+            node, state, total = stack.pop()
+            for token, child in node.items():
+                if token is None:
+                    for i in child:
+                        scores[i] = float(total)
+                else:
+                    next_state, p = self.advance(state, token)
+                    stack.append((child, next_state, total + p))
+        return scores
+
+    def encode(self, sentences):
+        """
+        encode ngrams of a batch of sentences as integer ids
+        :param sentences: list of sentences as lists of tokens
+        :return: ngram index (ngram -> id), flat array of ngram ids, array of sentence offsets
+        """
+        from array import array
+        size = self.model.size
+        index = {}
+        ids = array('q')
+        offsets = array('q', [0])
+        for sent in sentences:
+            for i in range(len(sent) - size + 1):
+                ids.append(index.setdefault(tuple(sent[i:i + size]), len(index)))
+            offsets.append(len(ids))
+        return index, ids, offsets
+
+    def score_batch(self, sentences):
+        """
+        score a batch of sequences; compact models (ArrayTrie) are scored in bulk with numpy (see score_bulk),
+        otherwise every distinct ngram of the batch is looked up (and backed-off) once with logprob
+        :param sentences: list of sentences as lists of tokens
+        :return: array of sentence scores (numpy array for compact models scored in bulk)
+        """
+        from array import array
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+
+        if numpy is not None and isinstance(self.model, ArrayTrie):
+            return self.score_bulk(sentences)
+
+        from collections import Counter
+        index, ids, offsets = self.encode(sentences)
+        occurrences = Counter(ids)
+        probs = array('d')
+        for ngram, i in index.items():
+            hits, oov = self.stats.hits, self.stats.oov
+            probs.append(self.logprob(ngram))
+            # lookup counters are per occurrence (as with score)
+            repeats = occurrences[i] - 1
+            self.stats.lookups += repeats
+            self.stats.hits += (self.stats.hits - hits) * repeats
+            self.stats.oov += (self.stats.oov - oov) * repeats
+        return array('d', (float(sum(map(probs.__getitem__, ids[offsets[i]:offsets[i + 1]])))
+                           for i in range(len(offsets) - 1)))
+
+    def score_bulk(self, sentences):
+        """
+        score a batch of sequences with a compact model (numpy): tokens are encoded as word ids once,
+        nodes of all ngrams are searched order by order (see ArrayTrie.lookup) & back-off is computed for
+        all missing ngrams at once (see backoff_bulk)
+        :param sentences: list of sentences as lists of tokens
+        :return: numpy array of sentence scores
+        """
+        import numpy as np
+        model = self.model
+        size = model.size
+
+        tokens = [token for sent in sentences for token in sent]
+        lengths = np.fromiter(map(len, sentences), dtype=np.int64, count=len(sentences))
+        words = np.fromiter(map(lambda token: model.ids.get(token, -1), tokens), dtype=np.int64, count=len(tokens))
+
+        # ngram start positions & sentence of every ngram
+        counts = np.maximum(lengths - size + 1, 0)
+        starts = np.cumsum(lengths) - lengths
+        sents = np.repeat(np.arange(len(sentences)), counts)
+        positions = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        grams = words[positions[:, None] + np.arange(size)]
+
+        probs, _, found, known = model.lookup(grams)
+        scores = probs[:, -1].copy()
+        missing = ~found
+        scores[missing] = self.backoff_bulk(grams[missing])
+
+        self.stats.lookups += len(grams)
+        self.stats.hits += int(found.sum())
+        self.stats.oov += int((missing & ~known).sum())
+
+        return np.bincount(sents, weights=scores, minlength=len(sentences))
+
+    def lower_bulk(self, grams):
+        """
+        log probabilities of ngrams of the same size with a compact model (numpy, see lower)
+        :param grams: 2-D array of word ids (one ngram per row; -1 for unknown words)
+        :return: array of values
+        """
+        probs, _, found, _ = self.model.lookup(grams)
+        scores = probs[:, -1].copy()
+        scores[~found] = self.backoff_bulk(grams[~found])
+        return scores
+
+    def backoff_bulk(self, grams):
+        """
+        back-off log probabilities of ngrams of the same size that are not in a compact model (numpy, see backoff)
+        :param grams: 2-D array of word ids (one ngram per row; -1 for unknown words)
+        :return: array of values
+        """
+        import numpy as np
+        model = self.model
+        rows, size = grams.shape
+        if getattr(model, 'bows', None) and not getattr(model, 'pruned', False):
+            return model.katz_bulk(grams)
+
+        probs, _, _, _ = model.lookup(grams)
+        if model.backoff:
+            scores = 0
+            for i in range(size):
+                scores = scores + probs[:, i] * model.weights[i]
+        else:
+            scores = np.full(rows, getattr(model.oov, 'probability', self.ZERO_LOG_PROB), dtype=np.float64)
+
+        if getattr(model, 'pruned', False) and size > 1 and size - 1 < len(model.bows):
+            # contexts of pruned ngrams: back-off weight & lower-order probability
+            _, node, found, _ = model.lookup(grams[:, :-1])
+            bows = np.frombuffer(model.bows[size - 1], dtype=np.float64)[node]
+            found &= ~np.isnan(bows)
+            scores[found] = np.maximum(bows[found] + self.lower_bulk(grams[found, 1:]), self.ZERO_LOG_PROB)
+        return scores
+
+    def perplexity(self, corpus, weights=None):
+        """
+        compute perplexity of a corpus: exp of negative average ngram log probability
+        :param corpus: list of sentences as lists of tokens
+        :param weights: sentence occurrence counts (default weights of a deduplicated Corpus)
+        :return: value
+        """
+        from math import exp
+        weights = weights if weights is not None else getattr(corpus, 'weights', None)
+        corpus = corpus if isinstance(corpus, list) else list(corpus)
+        weights = weights if weights else [1] * len(corpus)
+        count = sum(max(len(sent) - self.model.size + 1, 0) * w for sent, w in zip(corpus, weights))
+        total = sum(score * w for score, w in zip(self.score_batch(corpus), weights))
+        return exp(-total / count) if count else 1.0
+
+    def sampling_table(self, context):
+        """
+        cumulative probability table over the continuations of a context (built on first use & cached)
+        :param context: context as a tuple of tokens
+        :return: tuple of continuation words list & cumulative weights list
+        """
+        from math import exp
+        table = self.tables.get(context)
+        if table is None:
+            words, weights, total = [], [], 0.0
+            for word, node in self.model.get(context).children.items():
+                total += exp(node.probability)
+                words.append(word)
+                weights.append(total)
+            table = self.tables[context] = (words, weights)
+        return table
+
+    def generate(self, bos='<s>', eos='</s>', rng=None):
+        """
+        generate a random sequence from ngram model, sampling every word from its conditional distribution
         :param bos: beginning-of-sentence tag
         :param eos: end-of-sentence tag
+        :param rng: random number generator (random.Random); default random module
         :return: sentence as list & log probability
         """
         import random
+        rng = rng if rng else random
         word = bos
         sent = [bos] * (self.model.size - 1)
         while word != eos:
-            node = self.model.get(sent[-(self.model.size - 1):])
-            word = random.choice(list(node.children.keys()))
+            words, weights = self.sampling_table(tuple(sent[len(sent) - (self.model.size - 1):]))
+            word = rng.choices(words, cum_weights=weights)[0]
             sent.append(word)
         return sent
 
+    def generate_batch(self, k, bos='<s>', eos='</s>', seed=None):
+        """
+        generate k random sequences from ngram model
+        :param k: number of sequences
+        :param bos: beginning-of-sentence tag
+        :param eos: end-of-sentence tag
+        :param seed: random seed (for reproducible batches)
+        :return: list of sentences
+        """
+        import random
+        rng = random.Random(seed)
+        return [self.generate(bos=bos, eos=eos, rng=rng) for _ in range(k)]
+
+
+_counting = {}  # worker process state for parallel counting (set by count_init)
+
+
+def count_init(corpus, weights, vocab, n):
+    """
+    initialize worker process for parallel counting (with fork the corpus is shared, not pickled)
+    :param corpus: list-of-lists
+    :param weights: sentence occurrence counts (or None)
+    :param vocab: sorted vocabulary
+    :param n: ngram size
+    """
+    _counting.update(corpus=corpus, weights=weights, vocab=vocab, n=n)
+
+
+def count_range(bounds):
+    """
+    count ngrams with first word in a vocabulary range & build their arrays (worker function for parallel counting)
+    :param bounds: tuple of exclusive lower & inclusive upper bound words (None for open)
+    :return: tuple of words, counts & offsets arrays per order (of an ArrayTrie with global word ids)
+    """
+    from collections import Counter
+    lo, hi = bounds
+    corpus, weights, n = _counting['corpus'], _counting['weights'], _counting['n']
+
+    counts = Counter()
+    for sequence, weight in zip(corpus, weights) if weights else ((s, 1) for s in corpus):
+        for i in range(len(sequence) - n + 1):
+            word = sequence[i]
+            if (lo is None or word > lo) and (hi is None or word <= hi):
+                counts[tuple(sequence[i:i + n])] += weight
+
+    trie = ArrayTrie()
+    trie.build_sorted(sorted(counts.items()), _counting['vocab'], n)
+    return trie.words, trie.counts, trie.offsets
+
 
 def log2p(value):
     from math import exp
@@ -212,7 +1794,8 @@ def nbest(d, n=1):
     :param n: number of values to get (int)
     :return: dict of top n key-value pairs
     """
-    return dict(sorted(d.items(), key=lambda item: item[1], reverse=True)[:n])
+    from heapq import nlargest
+    return dict(nlargest(n, d.items(), key=lambda item: item[1]))
 
 
 def test_ngram():
@@ -249,8 +1832,571 @@ def test_generation():
         assert len(ngrams.generate()) > 2
 
 
+def test_estimate():
+    from math import log
+    corpus = [
+        ['the', 'cat', 'is', 'fat'],
+        ['the', 'dog', 'is', 'not'],
+        ['a', 'cat', 'is', 'on', 'the', 'mat'],
+        ['an', 'elephant', 'is', 'in', 'the', 'closet']
+    ]
+    ngrams = NgramModel(corpus=corpus, n=2, backoff=True)
+
+    # probabilities are conditioned on parent counts
+    assert ngrams.model.get(['the']).probability == log(4/16)
+    assert ngrams.model.get(['the', 'cat']).probability == log(1/4)
+
+    # interpolation weights are normalized
+    assert abs(sum(ngrams.model.weights) - 1.0) < 1e-9
+    assert ngrams.model.weights == NgramModel.deleted_interpolation(ngrams.model)
+
+    # empty corpus gives an empty model
+    empty = NgramModel([], n=2, smoothing=True, backoff=True)
+    assert empty.model.weights == [0.0, 1.0] and empty.score(['the', 'cat']) <= 0.0
+
+
+def test_score_batch():
+    from math import exp
+    corpus = [
+        ['<s>', 'the', 'cat', 'is', 'fat', '</s>'],
+        ['<s>', 'the', 'dog', 'is', 'not', '</s>'],
+        ['<s>', 'a', 'cat', 'is', 'on', 'the', 'mat', '</s>'],
+        ['<s>', 'an', 'elephant', 'is', 'in', 'the', 'closet', '</s>']
+    ]
+    seqs = [['<s>', 'the', 'cat', 'is', 'fat', '</s>'], ['<s>', 'my', 'cat', '</s>'], ['<s>']]
+    ngrams = NgramModel(corpus=corpus, n=2, smoothing=True, backoff=True)
+
+    assert list(ngrams.score_batch(seqs)) == [ngrams.score(s) for s in seqs]
+    assert ngrams.perplexity(seqs) == exp(-sum(ngrams.score(s) for s in seqs) / 8)
+    assert ngrams.perplexity(corpus) < ngrams.perplexity(seqs)
+
+    # distinct ngrams are looked up once, but lookup counters are per occurrence
+    ngrams.stats.reset()
+    scores = [ngrams.score(s) for s in seqs + seqs]
+    counters = (ngrams.stats.lookups, ngrams.stats.hits, ngrams.stats.oov)
+    ngrams.stats.reset()
+    assert list(ngrams.score_batch(seqs + seqs)) == scores
+    assert (ngrams.stats.lookups, ngrams.stats.hits, ngrams.stats.oov) == counters
+
+    # compact models are scored in bulk (numpy): same scores & lookup counters as scoring ngram by ngram
+    from importlib.util import find_spec
+    if find_spec('numpy') is None:
+        return
+    import os
+    import tempfile
+    seqs += [[], ['the', 'mat', 'is', 'my', 'closet', 'cat', 'is'], ['<s>', 'a', 'dog', 'in', 'the', 'mat']]
+    for n in [1, 2, 3]:
+        for smoothing, backoff in [(False, False), (True, False), (True, True)]:
+            ngrams = NgramModel(corpus=corpus, n=n, smoothing=smoothing, backoff=backoff, compact=True)
+            scores = [ngrams.score(s) for s in seqs]
+            counters = (ngrams.stats.lookups, ngrams.stats.hits, ngrams.stats.oov)
+            ngrams.stats.reset()
+            batch = ngrams.score_batch(seqs)
+            assert type(batch).__module__ == 'numpy' and list(batch) == scores
+            assert (ngrams.stats.lookups, ngrams.stats.hits, ngrams.stats.oov) == counters
+
+            # Katz back-off of ARPA models
+            with tempfile.TemporaryDirectory() as tmp:
+                ngrams.write_arpa(os.path.join(tmp, 'model.arpa'))
+                arpa = NgramModel()
+                arpa.read_arpa(os.path.join(tmp, 'model.arpa'))
+            assert list(arpa.score_batch(seqs)) == [arpa.score(s) for s in seqs]
+
+
+def test_save_load():
+    import os
+    import tempfile
+    corpus = [
+        ['<s>', 'the', 'cat', 'is', 'fat', '</s>'],
+        ['<s>', 'the', 'dog', 'is', 'not', '</s>'],
+        ['<s>', 'a', 'cat', 'is', 'on', 'the', 'mat', '</s>'],
+        ['<s>', 'an', 'elephant', 'is', 'in', 'the', 'closet', '</s>']
+    ]
+    seqs = [['<s>', 'the', 'cat', 'is', 'fat', '</s>'], ['<s>', 'my', 'cat', '</s>']]
+    ngrams = NgramModel(corpus=corpus, n=3, smoothing=True, backoff=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model.bin')
+        ngrams.save(path)
+        for mmap in [True, False]:
+            loaded = NgramModel()
+            loaded.load(path, mmap=mmap)
+            assert loaded.model.size == 3 and loaded.model.smoothing and loaded.model.backoff
+            assert loaded.model.weights == ngrams.model.weights
+            assert list(loaded.model.traverse()) == sorted(list(s) for s in ngrams.model.traverse())
+            assert [loaded.score(s) for s in seqs] == [ngrams.score(s) for s in seqs]
+
+            # search keys are stored (not recomputed per process) & agree with keys computed without numpy
+            assert [list(keys) for keys in loaded.model.search[1:]] == \
+                [list(keys) for keys in ArrayTrie(ngrams.model).search_keys()[1:]]
+            del loaded
+
+
+def test_parallel_count():
+    corpus = [
+        ['<s>', 'the', 'cat', 'is', 'fat', '</s>'],
+        ['<s>', 'the', 'dog', 'is', 'not', '</s>'],
+        ['<s>', 'a', 'cat', 'is', 'on', 'the', 'mat', '</s>'],
+        ['<s>', 'an', 'elephant', 'is', 'in', 'the', 'closet', '</s>']
+    ]
+    serial = NgramModel(corpus=corpus, n=3, smoothing=True, backoff=True, compact=True)
+    for workers in [2, 3, 20]:
+        parallel = NgramModel(corpus=corpus, n=3, smoothing=True, backoff=True, compact=True, workers=workers)
+
+        assert isinstance(parallel.model, ArrayTrie)
+        assert parallel.model.weights == serial.model.weights
+        assert parallel.model.distinct == serial.model.distinct
+        for (d1, n1, _), (d2, n2, _) in zip(serial.model.walk(), parallel.model.walk()):
+            assert (d1, n1.word, n1.count, n1.probability) == (d2, n2.word, n2.count, n2.probability)
+
+    # parallel counts are an ArrayTrie: without compact, models are counted serially or not at all
+    try:
+        NgramModel(corpus=corpus, n=3, workers=2)
+        assert False
+    except ValueError:
+        pass
+    assert isinstance(NgramModel().count(corpus, n=3), Trie)
+
+    # counts of a parallel model converted to a Trie can be updated & pruned like serial ones
+    serial = NgramModel(corpus=corpus, n=3, smoothing=True, backoff=True)
+    parallel = NgramModel(corpus=corpus, n=3, smoothing=True, backoff=True, compact=True, workers=2)
+    parallel.model = Trie(parallel.model)
+    assert parallel.model.weights == serial.model.weights
+    assert (parallel.model.distinct, parallel.model.leaves, parallel.model.count_of_counts) == \
+        (serial.model.distinct, serial.model.leaves, serial.model.count_of_counts)
+    assert sorted(parallel.model.traverse()) == sorted(serial.model.traverse())
+    for model in [serial, parallel]:
+        model.update(corpus[:1])
+        model.prune(min_count=2)
+    assert sorted(parallel.model.traverse()) == sorted(serial.model.traverse())
+
+
+def test_external_count():
+    corpus = [
+        ['<s>', 'the', 'cat', 'is', 'fat', '</s>'],
+        ['<s>', 'the', 'dog', 'is', 'not', '</s>'],
+        ['<s>', 'a', 'cat', 'is', 'on', 'the', 'mat', '</s>'],
+        ['<s>', 'an', 'elephant', 'is', 'in', 'the', 'closet', '</s>']
+    ]
+    seqs = [['<s>', 'the', 'cat', 'is', 'fat', '</s>'], ['<s>', 'my', 'cat', '</s>']]
+    for n in [1, 2, 3]:
+        compact = NgramModel(corpus=corpus, n=n, smoothing=True, backoff=True, compact=True)
+        external = NgramModel(corpus=iter(corpus), n=n, smoothing=True, backoff=True, memory=4)
+
+        assert isinstance(external.model, ArrayTrie)
+        assert list(external.model.words[n]) == list(compact.model.words[n])
+        assert list(external.model.counts[n]) == list(compact.model.counts[n])
+        assert list(external.model.probs[n]) == list(compact.model.probs[n])
+        assert external.model.weights == compact.model.weights
+        assert [external.score(s) for s in seqs] == [compact.score(s) for s in seqs]
+
+    # tokens with separators
+    corpus = [['<s>', 'new york', 'is', '</s>'], ['<s>', 'a\tb', 'is\n', '</s>'], ['<s>', 'new york', 'is', '</s>']]
+    compact = NgramModel(corpus=corpus, n=2, compact=True)
+    external = NgramModel(corpus=corpus, n=2, memory=1)
+    assert list(external.model.traverse()) == list(compact.model.traverse())
+    assert list(external.model.counts[2]) == list(compact.model.counts[2])
+
+
+def test_generate_batch():
+    import random
+    corpus = [
+        ['<s>', 'the', 'cat', 'is', 'fat', '</s>'],
+        ['<s>', 'the', 'cat', 'is', 'not', '</s>'],
+        ['<s>', 'the', 'cat', 'is', 'on', 'the', 'mat', '</s>'],
+        ['<s>', 'the', 'dog', 'is', 'in', 'the', 'closet', '</s>']
+    ]
+    ngrams = NgramModel(corpus=corpus, n=2)
+
+    sents = ngrams.generate_batch(500, seed=1)
+    assert sents == ngrams.generate_batch(500, seed=1)
+    assert all(s[0] == '<s>' and s[-1] == '</s>' for s in sents)
+
+    # continuations are sampled by probability: P(cat|the) = 0.5, P(mat|the) = P(dog|the) = P(closet|the) = 1/6
+    follow = [s[i + 1] for s in sents for i in range(len(s) - 1) if s[i] == 'the']
+    assert 0.4 < follow.count('cat') / len(follow) < 0.6
+
+    unigrams = NgramModel(corpus=corpus, n=1)
+    assert unigrams.generate(rng=random.Random(1))[-1] == '</s>'
+
+
+def test_advance():
+    corpus = [
+        ['<s>', 'the', 'cat', 'is', 'fat', '</s>'],
+        ['<s>', 'the', 'dog', 'is', 'not', '</s>'],
+        ['<s>', 'a', 'cat', 'is', 'on', 'the', 'mat', '</s>'],
+        ['<s>', 'an', 'elephant', 'is', 'in', 'the', 'closet', '</s>']
+    ]
+    seqs = [['<s>', 'the', 'cat', 'is', 'fat', '</s>'], ['<s>', 'my', 'cat', '</s>'], ['cat']]
+    for n in [1, 2, 3]:
+        for compact in [False, True]:
+            ngrams = NgramModel(corpus=corpus, n=n, smoothing=True, backoff=True, compact=compact)
+            for s in seqs:
+                state, probs = ngrams.initial_state(history=[]), []
+                for token in s:
+                    state, p = ngrams.advance(state, token)
+                    probs.append(p)
+                assert float(sum(probs)) == ngrams.score(s)
+
+            # states are shared between hypotheses with the same context
+            state = ngrams.initial_state()
+            assert ngrams.advance(state, 'the')[0] is ngrams.advance(ngrams.initial_state(), 'the')[0]
+
+
+def test_rescore():
+    corpus = [
+        ['<s>', 'the', 'cat', 'is', 'fat', '</s>'],
+        ['<s>', 'the', 'dog', 'is', 'not', '</s>'],
+        ['<s>', 'a', 'cat', 'is', 'on', 'the', 'mat', '</s>'],
+        ['<s>', 'an', 'elephant', 'is', 'in', 'the', 'closet', '</s>']
+    ]
+    nbest = [
+        ['<s>', 'the', 'cat', 'is', 'fat', '</s>'],
+        ['<s>', 'the', 'cat', 'is', 'flat', '</s>'],
+        ['<s>', 'the', 'cat', 'is', 'fat', '</s>'],
+        ['<s>', 'the', 'cat'],
+        ['<s>', 'a', 'cat', 'is', 'fat', '</s>'],
+        []
+    ]
+    for n in [1, 2, 3]:
+        ngrams = NgramModel(corpus=corpus, n=n, smoothing=True, backoff=True)
+        assert ngrams.rescore(nbest) == [ngrams.score(h) for h in nbest]
+
+
+def test_prune():
+    corpus = [
+        ['<s>', 'the', 'cat', 'is', 'fat', '</s>'],
+        ['<s>', 'the', 'cat', 'is', 'not', '</s>'],
+        ['<s>', 'a', 'cat', 'is', 'on', 'the', 'mat', '</s>'],
+        ['<s>', 'an', 'elephant', 'is', 'in', 'the', 'closet', '</s>']
+    ]
+    seqs = [['<s>', 'the', 'cat', 'is', 'fat', '</s>'], ['<s>', 'my', 'cat', '</s>']]
+
+    ngrams = NgramModel(corpus=corpus, n=3, smoothing=True, backoff=True)
+    size = sum(1 for _ in ngrams.model.walk()) - 1
+    assert ngrams.prune(min_count=2) > 0
+    assert all(ngrams.model.get(s).count >= 2 for s in ngrams.model.traverse() if len(s) == 3)
+    assert abs(sum(ngrams.model.weights) - 1.0) < 1e-9
+    assert all(ngrams.score(s) <= 0.0 for s in seqs)
+
+    ngrams = NgramModel(corpus=corpus, n=3, smoothing=True, backoff=True)
+    assert ngrams.prune(target=size - 5) == 5
+    assert sum(1 for _ in ngrams.model.walk()) - 1 == size - 5
+
+    ngrams = NgramModel(corpus=corpus, n=3, backoff=True)
+    ngrams.prune(threshold=float('inf'))
+    assert all(len(s) < 3 for s in ngrams.model.traverse())
+
+    # conditional distributions of pruned contexts still sum to 1: left-over mass backs off to lower order
+    from math import exp
+    vocab = sorted({word for sent in corpus for word in sent})
+    for kwargs in [{'min_count': 2}, {'target': 20}, {'threshold': 0.1}]:
+        ngrams = NgramModel(corpus=corpus, n=2, backoff=True)
+        assert abs(sum(exp(ngrams.logprob(['the', word])) for word in vocab) - 1.0) < 1e-9
+        assert ngrams.prune(**kwargs) > 0
+        contexts = [word for word in vocab if hasattr(ngrams.model.get([word]), 'bow')]
+        assert contexts
+        for context in contexts:
+            assert abs(sum(exp(ngrams.logprob([context, word])) for word in vocab) - 1.0) < 1e-9
+
+        # & after updates of pruned contexts
+        ngrams.update([['<s>', 'the', 'dog', 'is', 'fat', '</s>']])
+        assert abs(sum(exp(ngrams.logprob(['the', word])) for word in vocab + ['dog']) - 1.0) < 1e-9
+
+    # back-off weights of pruned contexts are kept by compact & saved models
+    import os
+    import tempfile
+    from importlib.util import find_spec
+    ngrams = NgramModel(corpus=corpus, n=2, backoff=True)
+    ngrams.prune(min_count=2)
+    seqs.append(['<s>', 'the', 'elephant', 'is', 'on', 'the', 'cat', '</s>'])
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model.bin')
+        ngrams.save(path)
+        for mmap in [True, False, None]:
+            loaded = NgramModel()
+            if mmap is None:
+                loaded.model = ArrayTrie(ngrams.model)
+            else:
+                loaded.load(path, mmap=mmap)
+            assert abs(sum(exp(loaded.logprob(['the', word])) for word in vocab) - 1.0) < 1e-9
+            assert all(abs(loaded.score(s) - ngrams.score(s)) < 1e-9 for s in seqs)
+            if find_spec('numpy') is not None:
+                assert all(abs(a - ngrams.score(s)) < 1e-9 for a, s in zip(loaded.score_bulk(seqs), seqs))
+
+            # & by trie nodes rebuilt from arrays
+            loaded.model = Trie(loaded.model)
+            assert all(abs(loaded.score(s) - ngrams.score(s)) < 1e-9 for s in seqs)
+            del loaded
+
+
+def test_arpa():
+    import os
+    import tempfile
+    from math import log
+    corpus = [
+        ['<s>', 'the', 'cat', 'is', 'fat', '</s>'],
+        ['<s>', 'the', 'dog', 'is', 'not', '</s>'],
+        ['<s>', 'a', 'cat', 'is', 'on', 'the', 'mat', '</s>'],
+        ['<s>', 'an', 'elephant', 'is', 'in', 'the', 'closet', '</s>']
+    ]
+    seqs = [['<s>', 'the', 'cat', 'is', 'fat', '</s>'], ['<s>', 'a', 'cat', 'is', 'not', '</s>']]
+    arpa = "\n".join([
+        "\\data\\", "ngram 1=3", "ngram 2=2", "",
+        "\\1-grams:", "-1.0\t<s>\t-0.5", "-0.5\tcat\t-0.2", "-0.5\t</s>", "",
+        "\\2-grams:", "-0.2\t<s> cat", "-0.1\tcat </s>", "", "\\end\\", ""])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model.arpa')
+        with open(path, 'w') as f:
+            f.write(arpa)
+        ngrams = NgramModel()
+        ngrams.read_arpa(path)
+        assert ngrams.model.size == 2
+        assert abs(ngrams.score(['<s>', 'cat', '</s>']) - (-0.3 * log(10))) < 1e-9
+        assert ngrams.score(['<s>', 'dog']) == ngrams.ZERO_LOG_PROB
+
+        # Katz back-off: bo(cat) + p(cat), bo(</s>) is missing (log 1)
+        assert abs(ngrams.score(['cat', 'cat']) - (-0.7 * log(10))) < 1e-9
+        assert abs(ngrams.score(['</s>', 'cat']) - (-0.5 * log(10))) < 1e-9
+        state, p = ngrams.advance(ngrams.initial_state(history=['cat']), 'cat')
+        assert abs(p - (-0.7 * log(10))) < 1e-9
+
+        # back-off weights are kept by binary format & written back to ARPA
+        model_file = os.path.join(tmp, 'model.bin')
+        ngrams.save(model_file)
+        binary = NgramModel()
+        binary.load(model_file, mmap=False)
+        assert abs(binary.score(['cat', 'cat']) - (-0.7 * log(10))) < 1e-9
+
+        # highest order is kept without \end\
+        with open(path, 'w') as f:
+            f.write(arpa[:arpa.index("\\end\\")])
+        truncated = NgramModel()
+        truncated.read_arpa(path)
+        assert truncated.model.size == 2 and truncated.score(['<s>', 'cat']) == ngrams.score(['<s>', 'cat'])
+
+        binary.write_arpa(path)
+        assert "-0.5\tcat\t-0.2" in open(path).read()
+
+        # round-trip (no back-off: seen contexts have no left-over mass)
+        ngrams = NgramModel(corpus=corpus, n=3)
+        ngrams.write_arpa(path)
+        loaded = NgramModel()
+        loaded.read_arpa(path)
+        # every word has a unigram (words that only end ngrams, e.g. </s>, with log10 0 = -99)
+        vocab = {word for sent in corpus for word in sent}
+        missing = [[word] for word in vocab if word not in ngrams.model.root.children]
+        assert '</s>' in vocab and ['</s>'] in missing
+        assert sorted(loaded.model.traverse()) == sorted([list(s) for s in ngrams.model.traverse()] + missing)
+        assert "ngram 1={}\n".format(len(vocab)) in open(path).read() and "-99.0\t</s>\n" in open(path).read()
+        for s in seqs:
+            assert abs(loaded.score(s) - ngrams.score(s)) < 1e-9
+
+        # round-trip of a smoothed model: left-over mass of contexts is written as back-off weights
+        ngrams = NgramModel(corpus=corpus, n=2, smoothing=True, backoff=True)
+        ngrams.write_arpa(path)
+        loaded = NgramModel()
+        loaded.read_arpa(path)
+        for s in seqs:
+            for ngram in NgramModel.ngrams(s, 2):
+                if ngrams.model.get(ngram).word is not None:
+                    assert abs(loaded.logprob(ngram) - ngrams.logprob(ngram)) < 1e-9
+        unseen = ['<s>', 'dog']
+        bo = loaded.model.bows[1][loaded.model.get(['<s>']).index]
+        assert ngrams.ZERO_LOG_PROB < bo < 0
+        assert abs(loaded.logprob(unseen) - (bo + loaded.model.get(['dog']).probability)) < 1e-9
+
+        # back-off keeps continuation probabilities of a context a distribution
+        from math import exp
+        words = [w for w in loaded.model.vocab if loaded.model.get([w]).word is not None]
+        assert sum(exp(loaded.logprob(['the', w])) for w in words) <= 1.0 + 1e-9
+
+
+def test_statistics():
+    from collections import Counter
+    corpus = [
+        ['<s>', 'the', 'cat', 'is', 'fat', '</s>'],
+        ['<s>', 'the', 'dog', 'is', 'not', '</s>'],
+        ['<s>', 'a', 'cat', 'is', 'on', 'the', 'mat', '</s>'],
+        ['<s>', 'an', 'elephant', 'is', 'in', 'the', 'closet', '</s>']
+    ]
+
+    def check(trie):
+        for size in range(trie.size + 2):
+            assert trie.v(size=size) == len(list(trie.traverse(size=size)))
+        nodes = [(depth, node) for depth, node, leaf in trie.walk() if depth]
+        assert trie.distinct[1:] == [sum(1 for d, n in nodes if d == k) for k in range(1, trie.size + 1)]
+        for k in range(1, trie.size + 1):
+            assert trie.count_of_counts[k] == dict(Counter(n.count for d, n in nodes if d == k))
+
+    for n in [1, 2, 3]:
+        ngrams = NgramModel(corpus=corpus, n=n, smoothing=True)
+        check(ngrams.model)
+        check(ArrayTrie(ngrams.model))
+
+        ngrams.model.add(['<s>', 'the', 'cat'][:n], count=3)
+        ngrams.prune(min_count=2)
+        check(ngrams.model)
+
+    trie = Trie()
+    assert trie.v() == 1
+    trie.add(['a', 'b'])
+    trie.rm(['a'])
+    assert trie.v() == 1 and trie.distinct == [1, 0, 0]
+
+
+def test_update():
+    corpus = [
+        ['<s>', 'the', 'cat', 'is', 'fat', '</s>'],
+        ['<s>', 'the', 'dog', 'is', 'not', '</s>'],
+        ['<s>', 'a', 'cat', 'is', 'on', 'the', 'mat', '</s>'],
+        ['<s>', 'the', 'cat', 'is', 'fat', '</s>'],
+    ]
+    for n in [1, 2, 3]:
+        for smoothing in [False, True]:
+            for split in [2, 3]:
+                full = NgramModel(corpus=corpus, n=n, smoothing=smoothing, backoff=True)
+                ngrams = NgramModel(corpus=corpus[:split], n=n, smoothing=smoothing, backoff=True)
+                ngrams.update(corpus[split:])
+
+                assert ngrams.model.weights == full.model.weights
+                assert ngrams.model.oov.probability == full.model.oov.probability
+                for (d1, n1, _), (d2, n2, _) in zip(full.model.walk(), ngrams.model.walk()):
+                    assert (d1, n1.word, n1.count) == (d2, n2.word, n2.count)
+                    assert getattr(n1, 'probability', None) == getattr(n2, 'probability', None)
+
+    # interpolation votes of all leaves depend on the total count: weights match retraining on any corpus
+    import random
+    rng = random.Random(0)
+    corpus = [['<s>'] + rng.choices('abcdef', k=rng.randint(2, 6)) + ['</s>'] for _ in range(30)]
+    full = NgramModel(corpus=corpus, n=3, backoff=True)
+    for split in [10, 15, 20, 25]:
+        ngrams = NgramModel(corpus=corpus[:split], n=3, backoff=True)
+        ngrams.update(corpus[split:])
+        assert ngrams.model.weights == full.model.weights
+
+
+def test_compact():
+    corpus = [
+        ['<s>', 'the', 'cat', 'is', 'fat', '</s>'],
+        ['<s>', 'the', 'dog', 'is', 'not', '</s>'],
+        ['<s>', 'a', 'cat', 'is', 'on', 'the', 'mat', '</s>'],
+        ['<s>', 'an', 'elephant', 'is', 'in', 'the', 'closet', '</s>']
+    ]
+    seqs = [['<s>', 'the', 'cat', 'is', 'fat', '</s>'], ['<s>', 'my', 'cat', '</s>']]
+    for n in [1, 2, 3]:
+        ngrams = NgramModel(corpus=corpus, n=n, smoothing=True, backoff=True)
+        compact = NgramModel(corpus=corpus, n=n, smoothing=True, backoff=True, compact=True)
+
+        assert isinstance(compact.model, ArrayTrie)
+        assert list(compact.model.traverse()) == sorted(list(s) for s in ngrams.model.traverse())
+        assert compact.model.v(size=n - 1) == ngrams.model.v(size=n - 1)
+
+        for s in seqs:
+            assert compact.score(s) == ngrams.score(s)
+
+        for ngram in ngrams.model.traverse():
+            assert compact.model.get(ngram).count == ngrams.model.get(ngram).count
+            assert compact.model.get(ngram).probability == ngrams.model.get(ngram).probability
+
+    compact = NgramModel(corpus=corpus, n=2, compact=True)
+    for i in range(5):
+        assert len(compact.generate()) > 2
+
+
+def test_stats():
+    corpus = [
+        ['<s>', 'the', 'cat', 'is', 'fat', '</s>'],
+        ['<s>', 'the', 'dog', 'is', 'not', '</s>'],
+        ['<s>', 'a', 'cat', 'is', 'on', 'the', 'mat', '</s>'],
+        ['<s>', 'an', 'elephant', 'is', 'in', 'the', 'closet', '</s>']
+    ]
+    phases = []
+    lm = NgramModel(corpus, n=2, smoothing=True, backoff=True, callbacks=[lambda phase, seconds: phases.append(phase)])
+    assert phases == ['count', 'smoothing', 'estimate']
+    assert list(lm.stats.timers) == phases and all(t >= 0 for t in lm.stats.timers.values())
+
+    lm.score(['<s>', 'the', 'cat', 'is', 'a', 'dog', '</s>'])  # 'is a', 'a dog', 'dog </s>' are unseen
+    lm.score(['<s>', 'the', 'cow', '</s>'])                    # 'cow' is oov
+    report = lm.stats.report(lm.model)
+    # '</s>' has no unigram in a bigram trie (it never starts a bigram)
+    assert (report['lookups'], report['hits'], report['misses'], report['oov']) == (9, 4, 5, 3)
+    assert report['ngrams'] == lm.model.distinct[1:] and report['nodes'] == sum(lm.model.distinct)
+    assert report['memory'] > 0
+
+    state, p = lm.advance(lm.initial_state(), 'the')
+    assert (lm.stats.lookups, lm.stats.hits) == (10, 5)
+
+    lm.prune(min_count=2)
+    assert 'prune' in lm.stats.timers
+
+    compact = NgramModel(corpus, n=2, smoothing=True, compact=True)
+    assert list(compact.stats.timers) == ['count', 'smoothing', 'estimate', 'compact']
+    assert compact.stats.report(compact.model)['ngrams'] == NgramModel(corpus, n=2).model.distinct[1:]
+    assert 0 < compact.model.nbytes() < NgramModel(corpus, n=2).model.nbytes()
+
+
+def test_weighted():
+    from corpus import Corpus
+    corpus = [
+        ['<s>', 'the', 'cat', 'is', 'fat', '</s>'],
+        ['<s>', 'the', 'dog', 'is', 'not', '</s>'],
+        ['<s>', 'a', 'cat', 'is', 'on', 'the', 'mat', '</s>'],
+        ['<s>', 'an', 'elephant', 'is', 'in', 'the', 'closet', '</s>']
+    ]
+    repetitive = [sent for sent, k in zip(corpus, [5, 1, 3, 2]) for _ in range(k)]
+
+    dedup = Corpus()
+    dedup.corpus = list(repetitive)
+    dedup.dedup()
+    assert dedup.weights == [5, 1, 3, 2]
+
+    def ngrams(model):
+        return sorted((tuple(ngram), model.get(ngram).count, model.get(ngram).probability)
+                      for ngram in model.traverse(size=model.size))
+
+    full = NgramModel(repetitive, n=3, smoothing=True, backoff=True)
+    for lm in [NgramModel(dedup, n=3, smoothing=True, backoff=True),
+               NgramModel(dedup.corpus, n=3, smoothing=True, backoff=True, weights=dedup.weights),
+               NgramModel(dedup, n=3, smoothing=True, backoff=True, compact=True, workers=2),
+               NgramModel(dedup, n=3, smoothing=True, backoff=True, memory=5)]:
+        assert ngrams(lm.model) == ngrams(full.model)
+        assert lm.model.weights == full.model.weights
+
+    assert abs(full.perplexity(dedup) - full.perplexity(repetitive)) < 1e-9
+
+    lm = NgramModel(corpus[:1], n=2)
+    lm.update(dedup)
+    assert ngrams(lm.model) == ngrams(NgramModel(corpus[:1] + repetitive, n=2).model)
+
+    # lazy corpus (stream) is read once, by counting
+    import os
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'corpus.txt')
+        dedup.write(path)
+        lm = NgramModel(Corpus(path, lazy=True), n=3, smoothing=True, backoff=True)
+    assert ngrams(lm.model) == ngrams(full.model)
+
+
 if __name__ == '__main__':
     print("Testing Only...")
     test_ngram()
     test_generation()
+    test_estimate()
+    test_score_batch()
+    test_save_load()
+    test_parallel_count()
+    test_external_count()
+    test_generate_batch()
+    test_advance()
+    test_rescore()
+    test_prune()
+    test_arpa()
+    test_statistics()
+    test_update()
+    test_compact()
+    test_stats()
+    test_weighted()
     print("Done!")